@@ -33,6 +33,9 @@ virtualenv --clear --download \
 (
     source $AUTOMATION_LIB_PATH/ccia.venv/bin/activate
     pip3 install --requirement ./requirements.txt
+    # Also importable as the 'ccia' module by python3 from the venv
+    install -v $INST_PERM_ARG -m '0644' -D ./cirrus-ci_artifacts.py \
+        "$(python3 -c 'import sysconfig; print(sysconfig.get_path("purelib"))')/ccia.py"
     deactivate
 )
 install -v $INST_PERM_ARG -m '0644' -D -t "$INSTALL_PREFIX/lib/ccia.venv/bin" \
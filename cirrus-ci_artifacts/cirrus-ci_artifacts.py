@@ -13,15 +13,28 @@ Input arguments (in order):
 """
 
 import asyncio
+import gzip
+import logging
+import multiprocessing
 import re
+import sqlite3
 import sys
+import tarfile
 from argparse import ArgumentParser
-from os import makedirs
-from os.path import split
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import AsyncExitStack, contextmanager, nullcontext
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import partial
+from multiprocessing.connection import Connection
+from os import makedirs, pipe, pwrite, remove
+from os.path import join, normpath, split
+from shutil import copyfileobj
 from urllib.parse import quote, unquote
 
 # Ref: https://docs.aiohttp.org/en/stable/http_request_lifecycle.html
-from aiohttp import ClientSession
+from aiohttp import ClientError, ClientSession
 # Ref: https://gql.readthedocs.io/en/latest/index.html
 # pip3 install --user --requirement ./requirements.txt
 # (and/or in a python virtual environment)
@@ -39,23 +52,114 @@ CCI_GQL_URL = "https://api.cirrus-ci.com/graphql"
 # "/<CIRRUS_BUILD_ID>/<TASK NAME OR ALIAS>/<ARTIFACTS_NAME>/<PATH>"
 CCI_ART_URL = "https://api.cirrus-ci.com/v1/artifact/build"
 
-# Set True when --verbose is first argument
-VERBOSE = False
+# Maximum number of threads performing blocking filesystem operations
+FS_WORKERS = 4
 
-def get_tasks(gqlclient, buildId):  # noqa N803
-    """Given a build ID, return a list of task objects."""
+# Number of bytes read from the network before each write to disk
+CHUNK_SIZE = 256 * 1024
+
+# Initial, lower and upper bounds on the number of simultaneous downloads
+INIT_PARALLEL = 4
+MIN_PARALLEL = 1
+MAX_PARALLEL = 32
+
+# Halve parallelism when mean time-to-first-byte exceeds the best seen by this factor
+LATENCY_FACTOR = 2.0
+
+# Minimum seconds between successive decreases in parallelism
+DECREASE_INTERVAL = 1.0
+
+# Number of times to retry a download after a 429 or 5xx response
+RETRIES = 5
+
+# Seconds to wait before the first retry, when the server doesn't say (doubles each retry)
+RETRY_DELAY = 1.0
+
+# Files larger than this many bytes are downloaded as parallel Range-request segments
+SEGMENT_SIZE = 128 * 1024 * 1024
+
+# Download ordering policies for the global work queue, the first is the default.
+# "largest" minimizes total wall-clock time, "smallest" gives quicker partial results.
+SCHEDULES = ("largest", "smallest", "listed")
+
+# Throughput floor (bytes/second) below which a duplicate "hedge" request is started
+MIN_RATE = 32 * 1024
+
+# Seconds over which transfer throughput is measured against MIN_RATE
+RATE_WINDOW = 20.0
+
+# Seconds between checks of transfer throughput
+RATE_INTERVAL = 1.0
+
+# Maximum number of processes decompressing/unpacking downloaded files, None for one per CPU
+EXTRACT_WORKERS = None
+
+# Default number of most recent builds covered by --slowest and --largest
+INDEX_BUILDS = 10
+
+# Cirrus-CI build statuses which never change, such builds are never re-ingested.
+FINAL_STATUSES = ("COMPLETED", "FAILED", "ABORTED", "ERRORED")
+
+# Tables and indexes of the --index database
+INDEX_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS builds (
+        id TEXT PRIMARY KEY,
+        status TEXT,
+        created INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS tasks (
+        id TEXT PRIMARY KEY,
+        build_id TEXT NOT NULL REFERENCES builds(id),
+        name TEXT NOT NULL,
+        status TEXT,
+        duration INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS files (
+        task_id TEXT NOT NULL REFERENCES tasks(id),
+        artifact TEXT NOT NULL,
+        path TEXT NOT NULL,
+        size INTEGER,
+        PRIMARY KEY (task_id, artifact, path)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS builds_created ON builds(created);
+    CREATE INDEX IF NOT EXISTS tasks_build ON tasks(build_id);
+    CREATE INDEX IF NOT EXISTS files_size ON files(size);
+"""
+
+try:
+    from os import posix_fallocate
+except ImportError:  # Not available on all platforms
+    posix_fallocate = None
+
+try:
+    import zstandard
+except ImportError:  # Optional, .zst artifacts are left compressed without it
+    zstandard = None
+
+# Reports hedged and abandoned transfers, the CLI shows it on stderr.
+log = logging.getLogger("cirrus-ci_artifacts")
+
+
+def get_build(gqlclient, buildId):  # noqa N803
+    """Given a build ID, return the build object, including its list of task objects."""
     # Ref: https://cirrus-ci.org/api/
     query = gql('''
         query tasksByBuildId($buildId: ID!) {
           build(id: $buildId) {
+            id,
+            status,
+            buildCreatedTimestamp,
             tasks {
               name,
               id,
               buildId,
+              status,
+              durationInSeconds,
               artifacts {
                 name,
                 files {
-                  path
+                  path,
+                  size
                 }
               }
             }
@@ -67,13 +171,18 @@ def get_tasks(gqlclient, buildId):  # noqa N803
     if "build" in tasks and tasks["build"]:
         b = tasks["build"]
         if "tasks" in b and len(b["tasks"]):
-            return b["tasks"]
+            return b
         raise RuntimeError(f"No tasks found for build with ID {buildId}")
     raise RuntimeError(f"No Cirrus-CI build found with ID {buildId}")
 
 
-def task_art_url_sfxs(task):
-    """Given a task dict return list CCI_ART_URL suffixes for all artifacts."""
+def get_tasks(gqlclient, buildId):  # noqa N803
+    """Given a build ID, return a list of task objects."""
+    return get_build(gqlclient, buildId)["tasks"]
+
+
+def task_art_files(task):
+    """Given a task dict return list of (CCI_ART_URL suffix, size) for all artifacts."""
     result = []
     bid = task["buildId"]
     tname = quote(task["name"])  # Make safe for URLs
@@ -81,38 +190,994 @@ def task_art_url_sfxs(task):
         aname = quote(art["name"])
         for _file in art["files"]:
             fpath = quote(_file["path"])
-            result.append(f"{bid}/{tname}/{aname}/{fpath}")
+            result.append((f"{bid}/{tname}/{aname}/{fpath}", _file.get("size")))
     return result
 
 
-async def download_artifact(session, dest_path, dl_url):
-    """Asynchronous download contents of art_url as a byte-stream."""
-    # Last path component assumed to be the filename
-    makedirs(split(dest_path)[0], exist_ok=True)  # os.path.split
-    async with session.get(dl_url) as response:
-        with open(dest_path, "wb") as dest_file:
-            dest_file.write(await response.read())
+@contextmanager
+def gql_client():
+    """Yield a GraphQL client session with Cirrus-CI, closing it afterwards."""
+    transport = RequestsHTTPTransport(url=CCI_GQL_URL, verify=True, retries=3)
+    try:
+        with GQLClient(transport=transport, fetch_schema_from_transport=True) as gqlclient:
+            yield gqlclient
+    finally:
+        transport.close()
+
 
+def fetch_tasks(buildId):  # noqa N803
+    """Given a build ID, query Cirrus-CI and return a list of task objects."""
+    with gql_client() as gqlclient:
+        return get_tasks(gqlclient, buildId)
 
-async def download_artifacts(task, path_rx=None):
-    """Given a task dict, download all artifacts or matches to path_rx."""
-    downloaded = []
-    skipped = []
-    async with ClientSession() as session:
-        for art_url_sfx in task_art_url_sfxs(task):
-            dest_path = unquote(art_url_sfx)  # Strip off URL encoding
-            dl_url = f"{CCI_ART_URL}/{dest_path}"
-            if path_rx is None or bool(path_rx.search(dest_path)):
-                if VERBOSE:
-                    print(f"    Downloading '{dest_path}'")
-                    sys.stdout.flush()
-                await download_artifact(session, dest_path, dl_url)
-                downloaded.append(dest_path)
+
+def task_art_url_sfxs(task):
+    """Given a task dict return list CCI_ART_URL suffixes for all artifacts."""
+    return [art_url_sfx for art_url_sfx, _ in task_art_files(task)]
+
+
+def open_index(db_path):
+    """Return a connection to the SQLite database at db_path, creating its tables if needed."""
+    conn = sqlite3.connect(db_path)
+    conn.executescript(INDEX_SCHEMA)
+    return conn
+
+
+def is_indexed(conn, buildId):  # noqa N803
+    """Return True if the build ID is recorded in the index with a final status."""
+    row = conn.execute("SELECT status FROM builds WHERE id = ?", (str(buildId),)).fetchone()
+    return row is not None and row[0] in FINAL_STATUSES
+
+
+def index_build(conn, build):
+    """Upsert a get_build() build object, its tasks and artifact files in one transaction."""
+    tasks = [(task["id"], build["id"], task["name"], task.get("status"),
+              task.get("durationInSeconds"))
+             for task in build["tasks"]]
+    files = [(task["id"], art["name"], _file["path"], _file.get("size"))
+             for task in build["tasks"]
+             for art in task["artifacts"]
+             for _file in art["files"]]
+    with conn:
+        conn.execute("INSERT INTO builds (id, status, created) VALUES (?, ?, ?)"
+                     " ON CONFLICT (id) DO UPDATE SET"
+                     " status = excluded.status, created = excluded.created",
+                     (build["id"], build.get("status"), build.get("buildCreatedTimestamp")))
+        conn.executemany("INSERT INTO tasks (id, build_id, name, status, duration)"
+                         " VALUES (?, ?, ?, ?, ?)"
+                         " ON CONFLICT (id) DO UPDATE SET"
+                         " name = excluded.name, status = excluded.status,"
+                         " duration = excluded.duration",
+                         tasks)
+        conn.executemany("INSERT INTO files (task_id, artifact, path, size)"
+                         " VALUES (?, ?, ?, ?)"
+                         " ON CONFLICT (task_id, artifact, path) DO UPDATE SET"
+                         " size = excluded.size",
+                         files)
+
+
+def ingest(conn, buildIds):  # noqa N803
+    """
+    Record each build ID in the index, returning those indexed from Cirrus-CI.
+
+    Builds already indexed with a final status are skipped without any
+    query.  Others are (re-)queried, until they finish.  Unknown builds,
+    or those without tasks, are logged and skipped.
+    """
+    todo = [bid for bid in buildIds if not is_indexed(conn, bid)]
+    indexed = []
+    if todo:
+        with gql_client() as gqlclient:
+            for bid in todo:
+                try:
+                    build = get_build(gqlclient, bid)
+                except RuntimeError as xcpt:
+                    log.warning(f"Skipping build {bid}: {xcpt}")
+                    continue
+                index_build(conn, build)
+                indexed.append(bid)
+    return indexed
+
+
+def _recent_builds(builds):
+    """Return SQL subquery and parameters, selecting IDs of the most recent builds."""
+    return "SELECT id FROM builds ORDER BY created DESC LIMIT ?", (builds,)
+
+
+def slowest_tasks(conn, limit, builds=INDEX_BUILDS):
+    """Return (duration, status, build ID, task name) rows of the slowest tasks in recent builds."""
+    recent, params = _recent_builds(builds)
+    return conn.execute("SELECT duration, status, build_id, name FROM tasks"
+                        f" WHERE build_id IN ({recent}) AND duration IS NOT NULL"
+                        " ORDER BY duration DESC LIMIT ?",
+                        params + (limit,)).fetchall()
+
+
+def largest_files(conn, limit, builds=INDEX_BUILDS):
+    """Return (size, <build>/<task>/<artifact>/<path>) rows of the largest recent files."""
+    recent, params = _recent_builds(builds)
+    rows = conn.execute("SELECT files.size, tasks.build_id, tasks.name, files.artifact, files.path"
+                        " FROM files JOIN tasks ON files.task_id = tasks.id"
+                        f" WHERE tasks.build_id IN ({recent}) AND files.size IS NOT NULL"
+                        " ORDER BY files.size DESC LIMIT ?",
+                        params + (limit,)).fetchall()
+    return [(size, "/".join(parts)) for size, *parts in rows]
+
+
+class FSPool:
+    """Bounded thread-pool to keep blocking filesystem calls off the event loop."""
+
+    def __init__(self, max_workers=FS_WORKERS):
+        """Create a new pool of at most max_workers threads."""
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix="ccia_fs")
+        # Parent directory -> future, so each is only ever created once.
+        self.made_dirs = dict()
+
+    async def run(self, func, *args):
+        """Call func(*args) in a pool thread, returning its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def makedirs(self, dirpath):
+        """Create dirpath and any parents, at most once per pool."""
+        if dirpath not in self.made_dirs:
+            self.made_dirs[dirpath] = asyncio.ensure_future(self.run(_makedirs, dirpath))
+        # Don't let cancellation of one caller cancel creation for all others.
+        await asyncio.shield(self.made_dirs[dirpath])
+
+    def shutdown(self):
+        """Release the threads once pending operations finish, without blocking."""
+        self.executor.shutdown(wait=False)
+
+
+def _makedirs(dirpath):
+    """Call makedirs() on dirpath, ignoring when it already exists."""
+    makedirs(dirpath, exist_ok=True)
+
+
+def _open_dest(dest_path, size=None):
+    """Open dest_path for writing, preallocating size bytes when known."""
+    dest_file = open(dest_path, "wb")
+    if size:
+        try:
+            if posix_fallocate is None:
+                raise OSError("posix_fallocate() not supported")
+            posix_fallocate(dest_file.fileno(), 0, size)
+        except OSError:  # e.g. filesystem doesn't support it
+            dest_file.truncate(size)
+    return dest_file
+
+
+def _close_dest(dest_file, written):
+    """Trim any unused preallocated space from dest_file, then close it."""
+    try:
+        dest_file.truncate(written)
+    finally:
+        dest_file.close()
+
+
+class ArtifactFile:
+    """Destination file of an artifact, shared by all segments downloading it."""
+
+    def __init__(self, dest_path, fs_pool, size=None, segments=1):
+        """Represent dest_path, with size (when known) downloaded in segments."""
+        self.dest_path = dest_path
+        self.fs_pool = fs_pool
+        self.size = size
+        self.segments = segments
+        # Offset of the byte following the last one written
+        self.length = 0
+        # Segment start offset -> offset following its last byte written
+        self._segment_ends = dict()
+        # Loop time by which all segments must finish, set when the first starts.
+        self.deadline = None
+        # Set True when any segment missed the deadline or failed, with the reason why
+        self.failed = False
+        self.error = None
+        self.closed = False
+        self._opened = None
+        # In-flight writes, which must finish before closing.
+        self._writes = set()
+        # Task running extract_file(), then the list of extracted file paths
+        self.extracting = None
+        self.extracted = None
+        # Normalized paths of all artifact files of the same task, which
+        # extraction must not overwrite.
+        self.siblings = frozenset()
+
+    async def open(self):
+        """Create parent directories then open the file, at most once."""
+        if self._opened is None:
+            self._opened = asyncio.ensure_future(self._open())
+        # Don't let cancellation of one segment cancel opening for all others.
+        await asyncio.shield(self._opened)
+
+    async def _open(self):
+        # Last path component assumed to be the filename
+        await self.fs_pool.makedirs(split(self.dest_path)[0])  # os.path.split
+        return await self.fs_pool.run(_open_dest, self.dest_path, self.size)
+
+    @property
+    def written(self):
+        """Return the number of bytes written, counting those rewritten by hedges once."""
+        return sum(end - start for start, end in self._segment_ends.items())
+
+    async def write(self, chunk, offset, start=0):
+        """Write chunk at offset into the opened file, for the segment beginning at start."""
+        dest_file = self._opened.result()
+        write = asyncio.ensure_future(self.fs_pool.run(_pwrite_all, dest_file.fileno(),
+                                                       chunk, offset))
+        self._writes.add(write)
+        write.add_done_callback(self._writes.discard)
+        # A cancelled (e.g. hedged) transfer's write can't be stopped mid-way in
+        # the pool thread, it must complete before the file is closed.
+        await asyncio.shield(write)
+        self.mark_written(start, offset + len(chunk))
+
+    def mark_written(self, start, end):
+        """Record bytes up to end as written, by the segment beginning at start."""
+        self.length = max(self.length, end)
+        self._segment_ends[start] = max(self._segment_ends.get(start, start), end)
+
+    async def segment_done(self):
+        """Record a finished segment, closing the file and returning True after the last."""
+        self.segments -= 1
+        if self.segments > 0:
+            return False
+        await self.close()
+        return True
+
+    async def close(self):
+        """
+        Wait for opening and in-flight writes, then close the file if it was opened.
+
+        Unless every segment finished without failing, the file is then
+        removed, rather than leaving it incomplete under its final name.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self._opened is None:
+            return
+        # A deadline may cancel every segment while opening is still in the pool.
+        await asyncio.wait({self._opened})
+        if self._opened.cancelled() or self._opened.exception() is not None:
+            return
+        await asyncio.gather(*self._writes, return_exceptions=True)
+        await self.fs_pool.run(_close_dest, self._opened.result(), self.length)
+        if self.failed or self.segments > 0:
+            await self.fs_pool.run(remove, self.dest_path)
+
+
+def _pwrite_all(fd, data, offset):
+    """Write all of data to fd at offset."""
+    view = memoryview(data)
+    while view:
+        written = pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def _decompressor(dest_path):
+    """Return a function wrapping a binary file of dest_path as a decompressed stream, or None."""
+    if dest_path.endswith((".gz", ".tgz")):
+        return lambda raw: gzip.GzipFile(fileobj=raw)
+    if dest_path.endswith((".zst", ".tzst")) and zstandard is not None:
+        return lambda raw: zstandard.ZstdDecompressor().stream_reader(raw, closefd=False)
+    if dest_path.endswith(".tar"):
+        return nullcontext
+    return None
+
+
+def extractable(dest_path):
+    """Return True if extract() can decompress and/or unpack dest_path."""
+    return _decompressor(dest_path) is not None
+
+
+def _refuse_overwrite(path, reserved):
+    """Raise FileExistsError if path is one of the reserved (artifact file) paths."""
+    if normpath(path) in reserved:
+        raise FileExistsError(f"Refusing to overwrite artifact file '{path}'")
+
+
+def _extract_tar(stream, dirpath, reserved=frozenset()):
+    """Unpack the tar archive from stream into dirpath, returning file paths."""
+    result = []
+    # Stream mode reads members in order, without seeking back.
+    with tarfile.open(fileobj=stream, mode="r|") as archive:
+        if hasattr(tarfile, "data_filter"):
+            # Refuses members outside dirpath, and links or modes which could be abused.
+            archive.extraction_filter = tarfile.data_filter
+        for member in archive:
+            if member.name.startswith("/") or ".." in member.name.split("/"):
+                raise tarfile.TarError(f"Refusing to extract unsafe member '{member.name}'")
+            _refuse_overwrite(join(dirpath, member.name), reserved)
+            archive.extract(member, dirpath)
+            if member.isfile():
+                result.append(join(dirpath, member.name))
+    return result
+
+
+def extract(dest_path, source=None, reserved=frozenset()):
+    """
+    Decompress and/or unpack dest_path next to itself, then remove it.
+
+    Returns the list of extracted file paths, keeping the layout of
+    dest_path's directory.  The CPU-heavy work runs in a separate
+    process (see Extractor), reading and writing CHUNK_SIZE at a time.
+    When given, dest_path's content is read from the source binary file
+    instead, and dest_path needn't exist.  Extracted files may not
+    overwrite any of the reserved (normalized) paths.
+    """
+    opener = _decompressor(dest_path)
+    dirpath, filename = split(dest_path)
+    raw = open(dest_path, "rb") if source is None else nullcontext(source)
+    with raw as raw, opener(raw) as stream:
+        if filename.endswith((".tar", ".tgz", ".tzst")) or ".tar." in filename:
+            result = _extract_tar(stream, dirpath, reserved)
+        else:
+            out_path = dest_path.rsplit(".", 1)[0]
+            _refuse_overwrite(out_path, reserved)
+            try:
+                with open(out_path, "wb") as out_file:
+                    copyfileobj(stream, out_file, CHUNK_SIZE)
+            except Exception:
+                remove(out_path)  # Don't leave a truncated file behind
+                raise
+            result = [out_path]
+    if source is None:
+        remove(dest_path)
+    return result
+
+
+def extract_pipe(conn, dest_path, reserved=frozenset()):
+    """Call extract(), reading dest_path's content from the read-end Connection of a pipe."""
+    with conn, open(conn.fileno(), "rb", closefd=False) as source:
+        return extract(dest_path, source, reserved)
+
+
+class Extractor:
+    """Process-pool running extract() on downloaded files, off the event loop."""
+
+    def __init__(self, max_workers=EXTRACT_WORKERS):
+        """Create a new pool of at most max_workers processes."""
+        # Processes start after FSPool and executor threads exist, which
+        # fork() doesn't safely duplicate.
+        self.executor = ProcessPoolExecutor(max_workers=max_workers,
+                                            mp_context=multiprocessing.get_context("forkserver"))
+
+    async def __call__(self, dest_path, reserved=frozenset()):
+        """Return the extract() result for dest_path, from a pool process."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, extract, dest_path, None, reserved)
+
+    def pipe(self, dest_path, reserved=frozenset()):
+        """
+        Return an extract() future for dest_path, with a pipe feeding it.
+
+        The pipe is returned as an (asyncio) future of extract_pipe()'s
+        result, along with the read-end Connection and the write-end file
+        descriptor.  The read-end must stay open until the future is done,
+        as the pool process may not have taken its copy until then.
+        """
+        read_fd, write_fd = pipe()
+        reader = Connection(read_fd, writable=False)
+        loop = asyncio.get_running_loop()
+        extraction = loop.run_in_executor(self.executor, extract_pipe, reader, dest_path,
+                                          reserved)
+        return extraction, reader, write_fd
+
+    def shutdown(self):
+        """Drop extractions not yet started, release processes once others finish."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def segments(size, segment_size=SEGMENT_SIZE):
+    """Return list of (start, end) byte ranges, or [(0, None)] for the whole file."""
+    if not size or not segment_size or size <= segment_size:
+        return [(0, None)]
+    return [(start, min(start + segment_size, size))
+            for start in range(0, size, segment_size)]
+
+
+def schedule(work, policy=SCHEDULES[0]):
+    """Return work items (art_file, start, end) ordered by policy."""
+    def length(item):
+        art_file, start, end = item
+        if end is None:
+            return art_file.size or 0
+        return end - start
+
+    if policy == "largest":
+        return sorted(work, key=length, reverse=True)
+    if policy == "smallest":
+        return sorted(work, key=length)
+    if policy == "listed":
+        return list(work)
+    raise ValueError(f"Unknown schedule policy '{policy}', expecting one of {SCHEDULES}")
+
+
+class AIMDLimiter:
+    """
+    Async context manager limiting simultaneous downloads.
+
+    Additive-increase/multiplicative-decrease: Once every download slot has
+    completed a transfer (a round), parallelism increases by one if
+    aggregate throughput improved over the previous round.  It's halved
+    on 429/5xx responses, or when mean time-to-first-byte rises well above
+    the best observed.  An optional bandwidth (bytes/second) caps
+    aggregate throughput.
+    """
+
+    def __init__(self, initial=INIT_PARALLEL, minimum=MIN_PARALLEL,
+                 maximum=MAX_PARALLEL, bandwidth=None):
+        """Create a new limiter allowing initial simultaneous downloads."""
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = max(self.minimum, min(initial, self.maximum))
+        self.bandwidth = bandwidth
+        self.active = 0
+        self._cond = asyncio.Condition()
+        # Loop time before which no new request may start (i.e. Retry-After)
+        self._resume_at = 0.0
+        self._decreased_at = None
+        self._best_latency = None
+        self._best_rate = 0.0
+        self._round_start = None
+        self._round_latencies = []
+        self._round_bytes = 0
+        # Loop time when bandwidth-capped transfer may next proceed
+        self._bw_time = 0.0
+
+    @staticmethod
+    def now():
+        """Return the current event-loop time."""
+        return asyncio.get_running_loop().time()
+
+    async def __aenter__(self):
+        """Wait for a free download slot, and any Retry-After period."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        if self._round_start is None:
+            self._round_start = self.now()
+        delay = self._resume_at - self.now()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self
+
+    async def __aexit__(self, *args):
+        """Release a download slot."""
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def success(self, latency, nbytes):
+        """Record a completed transfer taking latency seconds to first byte."""
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+        self._round_latencies.append(latency)
+        self._round_bytes += nbytes
+        if len(self._round_latencies) < self.limit:
+            return
+        now = self.now()
+        if self._round_start is None:
+            self._round_start = now
+        mean_latency = sum(self._round_latencies) / len(self._round_latencies)
+        elapsed = now - self._round_start
+        rate = self._round_bytes / elapsed if elapsed > 0 else 0.0
+        if mean_latency > self._best_latency * LATENCY_FACTOR:
+            self.decrease()
+        elif rate > self._best_rate:
+            self._best_rate = rate
+            self.limit = min(self.maximum, self.limit + 1)
+        self._new_round(now)
+
+    def backoff(self, delay):
+        """Record a 429/5xx response, pause new requests for delay seconds."""
+        self._resume_at = max(self._resume_at, self.now() + delay)
+        self.decrease()
+
+    def decrease(self):
+        """Halve parallelism, at most once every DECREASE_INTERVAL seconds."""
+        now = self.now()
+        if self._decreased_at is not None and now - self._decreased_at < DECREASE_INTERVAL:
+            return
+        self._decreased_at = now
+        self.limit = max(self.minimum, self.limit // 2)
+        # Throughput expectations no longer hold at the lower parallelism.
+        self._best_rate = 0.0
+        self._new_round(now)
+
+    def _new_round(self, now):
+        self._round_start = now
+        self._round_latencies = []
+        self._round_bytes = 0
+
+    async def throttle(self, nbytes):
+        """Delay the caller as needed to keep under the bandwidth cap."""
+        if not self.bandwidth:
+            return
+        now = self.now()
+        self._bw_time = max(now, self._bw_time) + nbytes / self.bandwidth
+        delay = self._bw_time - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def retry_delay(response, attempt):
+    """Return seconds to wait before retrying, preferring any Retry-After header."""
+    value = response.headers.get("Retry-After")
+    if value is not None:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            pass
+        else:
+            if when.tzinfo is None:
+                when = when.replace(tzinfo=timezone.utc)
+            return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    return RETRY_DELAY * 2 ** attempt
+
+
+def is_retryable(status):
+    """Return True if an HTTP status indicates the server is overloaded."""
+    return status == 429 or status >= 500
+
+
+async def download_artifact(session, dl_url, art_file, start=0, end=None, limiter=None,
+                            progress=None):
+    """
+    Asynchronous download contents of dl_url, or bytes start to end, into art_file.
+
+    When given, progress(nbytes) is called with zero as each request is sent, then
+    with the length of each chunk written.
+    """
+    if limiter is None:
+        limiter = AIMDLimiter()
+    headers = dict()
+    if end is not None:
+        headers["Range"] = f"bytes={start}-{end - 1}"
+    for attempt in range(RETRIES + 1):
+        async with limiter:
+            began = limiter.now()
+            # Starts the Throughput clock, so a stall before headers arrive counts too.
+            if progress is not None:
+                progress(0)
+            async with session.get(dl_url, headers=headers) as response:
+                latency = limiter.now() - began
+                if is_retryable(response.status):
+                    if attempt == RETRIES:
+                        response.raise_for_status()
+                    limiter.backoff(retry_delay(response, attempt))
+                    continue
+                if response.status >= 400:
+                    # e.g. 403/404/410, the body is an error page, not the artifact.
+                    response.raise_for_status()
+                await art_file.open()
+                # Server may ignore the Range header, and send the whole file.
+                skip = start if end is not None and response.status != 206 else 0
+                offset = start
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    if skip:
+                        if len(chunk) <= skip:
+                            skip -= len(chunk)
+                            continue
+                        chunk = chunk[skip:]
+                        skip = 0
+                    if end is not None:
+                        chunk = chunk[:end - offset]
+                    await art_file.write(chunk, offset, start)
+                    offset += len(chunk)
+                    if progress is not None:
+                        progress(len(chunk))
+                    await limiter.throttle(len(chunk))
+                    if end is not None and offset >= end:
+                        break
+            limiter.success(latency, offset - start)
+            return
+
+
+class Throughput:
+    """Progress callback measuring transfer rate over a sliding window."""
+
+    def __init__(self, window=RATE_WINDOW):
+        """Measure over the most recent window seconds."""
+        self.window = window
+        # None until the request is sent
+        self.received = None
+        self._samples = deque()
+
+    def __call__(self, nbytes):
+        """Record nbytes received."""
+        self.received = (self.received or 0) + nbytes
+
+    def rate(self, now):
+        """Return bytes/second over the window ending now, or None if not yet measurable."""
+        if self.received is None:
+            return None
+        self._samples.append((now, self.received))
+        # Retain the newest sample at or before the start of the window
+        while len(self._samples) > 1 and self._samples[1][0] <= now - self.window:
+            self._samples.popleft()
+        then, received = self._samples[0]
+        if now - then < self.window:
+            return None
+        return (self.received - received) / (now - then)
+
+
+async def hedged_download(session, dl_url, art_file, start=0, end=None, limiter=None,
+                          min_rate=MIN_RATE, progress=None):
+    """
+    Call download_artifact(), hedging against a stalled transfer.
+
+    Should throughput stay below min_rate bytes/second for RATE_WINDOW
+    seconds, a duplicate request is started.  Whichever finishes first
+    is kept and the other cancelled.  Both write identical bytes at
+    identical offsets, so the loser's partial writes are harmless.
+    """
+    if limiter is None:
+        limiter = AIMDLimiter()
+    throughput = Throughput(RATE_WINDOW)
+
+    def primary_progress(nbytes):
+        throughput(nbytes)
+        if progress is not None:
+            progress(nbytes)
+
+    primary = asyncio.create_task(download_artifact(session, dl_url, art_file, start, end,
+                                                    limiter, primary_progress))
+    attempts = {primary}
+    hedged = False
+    try:
+        while True:
+            done, attempts = await asyncio.wait(attempts, timeout=RATE_INTERVAL,
+                                                return_when=asyncio.FIRST_COMPLETED)
+            # Prefer successful attempts, should more than one finish together.
+            for attempt in sorted(done, key=lambda attempt: attempt.exception() is not None):
+                # A failed attempt is only fatal when there's no other to fall back on
+                if attempt.exception() is None or not attempts:
+                    return attempt.result()
+            if hedged or not min_rate:
+                continue
+            rate = throughput.rate(limiter.now())
+            if rate is not None and rate < min_rate:
+                hedged = True
+                log.info(f"Slow transfer ({rate:.0f} B/s), hedging '{art_file.dest_path}'")
+                attempts.add(asyncio.create_task(
+                    download_artifact(session, dl_url, art_file, start, end, limiter, progress)))
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+        await asyncio.gather(*attempts, return_exceptions=True)
+
+
+class _PipeProtocol(asyncio.BaseProtocol):
+    """Flow control for an asyncio write-pipe transport."""
+
+    def __init__(self):
+        self.writable = asyncio.Event()
+        self.writable.set()
+        self.closed = False
+
+    def pause_writing(self):
+        self.writable.clear()
+
+    def resume_writing(self):
+        self.writable.set()
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self.writable.set()
+
+
+class ExtractStream:
+    """
+    Stands in for an ArtifactFile given to download_artifact(), piping it to an Extractor.
+
+    Chunks must be written in order, they're passed through to extract()
+    in a pool process, never written to disk.
+    """
+
+    def __init__(self, art_file, extraction, transport, protocol):
+        """Write chunks of art_file to the pipe transport, read by the extraction future."""
+        self.art_file = art_file
+        self.dest_path = art_file.dest_path
+        self.extraction = extraction
+        self.transport = transport
+        self.protocol = protocol
+
+    async def open(self):
+        """Do nothing, the pipe is already open."""
+
+    async def write(self, chunk, offset, start=0):
+        """Write chunk to the pipe, waiting while the extraction falls behind."""
+        if self.protocol.closed:
+            raise BrokenPipeError(f"Extraction stopped reading '{self.dest_path}'")
+        self.transport.write(chunk)
+        self.art_file.mark_written(start, offset + len(chunk))
+        if not self.protocol.writable.is_set():
+            writable = asyncio.ensure_future(self.protocol.writable.wait())
+            await asyncio.wait({writable, self.extraction}, return_when=asyncio.FIRST_COMPLETED)
+            if not writable.done():
+                writable.cancel()
+                raise BrokenPipeError(f"Extraction stopped reading '{self.dest_path}'")
+
+
+async def stream_extract(session, dl_url, art_file, extractor, limiter=None, progress=None):
+    """
+    Download dl_url straight into extract(), never writing art_file to disk.
+
+    The response is piped in order to an Extractor process, so no file is
+    written then read back.  Segments and hedges would write out of order,
+    so neither is used.  Sets art_file.extracted, or art_file.error after
+    logging any extraction failure.
+    """
+    # Extracted files go next to where art_file would be
+    await art_file.fs_pool.makedirs(split(art_file.dest_path)[0])
+    extraction, reader, write_fd = extractor.pipe(art_file.dest_path, art_file.siblings)
+    # The pool process takes its own copy of the read-end
+    extraction.add_done_callback(lambda _: reader.close())
+    loop = asyncio.get_running_loop()
+    try:
+        transport, protocol = await loop.connect_write_pipe(_PipeProtocol,
+                                                            open(write_fd, "wb", buffering=0))
+    except BaseException:
+        reader.close()
+        raise
+    try:
+        await download_artifact(session, dl_url, ExtractStream(art_file, extraction,
+                                                               transport, protocol),
+                                0, None, limiter, progress)
+    except BrokenPipeError:
+        transport.close()  # Extraction stopped reading, its result says why.
+    except BaseException:
+        transport.abort()
+        # Don't log the extraction failing on a truncated stream
+        extraction.add_done_callback(lambda future: future.cancelled() or future.exception())
+        raise
+    else:
+        transport.close()  # Extraction reads to the end, once buffered chunks are flushed
+    try:
+        art_file.extracted = await extraction
+    except Exception as xcpt:
+        log.warning(f"Failed extracting '{art_file.dest_path}': {xcpt}")
+        art_file.error = f"Extraction failed: {xcpt}"
+
+
+async def extract_file(extractor, art_file, finished):
+    """Extract a downloaded art_file then put it in finished, marked failed unless extracted."""
+    try:
+        art_file.extracted = await extractor(art_file.dest_path, art_file.siblings)
+    except Exception as xcpt:
+        log.warning(f"Failed extracting '{art_file.dest_path}': {xcpt}")
+        art_file.error = f"Extraction failed: {xcpt}"
+    finally:
+        art_file.failed = art_file.extracted is None
+        finished.put_nowait(art_file)
+
+
+async def download_worker(session, work, limiter, finished, min_rate=MIN_RATE,
+                          file_timeout=None, progress=None, extractor=None):
+    """
+    Download (art_file, start, end) items from work, putting completed art_files in finished.
+
+    When given an Extractor, extractable files are extracted first.  Those
+    downloaded whole are streamed into extraction (see stream_extract()),
+    others are extracted once downloaded, without holding up the worker's
+    next download.
+    """
+    while work:
+        art_file, start, end = work.popleft()
+        dest_path = art_file.dest_path
+        dl_url = f"{CCI_ART_URL}/{dest_path}"
+        if file_timeout and art_file.deadline is None:
+            art_file.deadline = limiter.now() + file_timeout
+        if not art_file.failed:
+            timeout = None
+            if art_file.deadline is not None:
+                timeout = max(0.0, art_file.deadline - limiter.now())
+            file_progress = None
+            if progress is not None:
+                file_progress = partial(progress, dest_path)
+            streamed = extractor is not None and end is None and extractable(dest_path)
+            try:
+                if streamed:
+                    await asyncio.wait_for(stream_extract(session, dl_url, art_file, extractor,
+                                                          limiter, file_progress),
+                                           timeout)
+                    art_file.failed = art_file.extracted is None
+                else:
+                    await asyncio.wait_for(hedged_download(session, dl_url, art_file, start,
+                                                           end, limiter, min_rate,
+                                                           file_progress),
+                                           timeout)
+            except asyncio.TimeoutError:  # Also an OSError, must be caught first
+                log.warning(f"Timed out downloading '{dest_path}'")
+                art_file.failed = True
+                art_file.error = "Timed out"
+            except (ClientError, OSError) as xcpt:
+                # Only this file failed, others carry on.
+                log.warning(f"Failed downloading '{dest_path}': {xcpt!r}")
+                art_file.failed = True
+                art_file.error = repr(xcpt)
+        if await art_file.segment_done():
+            if (extractor is not None and not art_file.failed and art_file.extracted is None
+                    and extractable(dest_path)):
+                art_file.extracting = asyncio.ensure_future(extract_file(extractor, art_file,
+                                                                         finished))
             else:
-                if VERBOSE:
-                    print(f"       Skipping '{dest_path}'")
-                skipped.append(dest_path)
-    return {"downloaded": downloaded, "skipped": skipped}
+                finished.put_nowait(art_file)
+
+
+async def iter_download(tasks, path_rx=None, session=None, progress=None,
+                        max_parallel=MAX_PARALLEL, bandwidth=None, policy=SCHEDULES[0],
+                        segment_size=SEGMENT_SIZE, min_rate=MIN_RATE, file_timeout=None,
+                        timeout=None, extract=False):
+    """
+    Asynchronously download artifacts of tasks, or matches to path_rx.
+
+    Yields a result dict for each artifact file, as soon as it's skipped
+    (not matching path_rx), downloaded, or failed (missed a deadline, or
+    an HTTP, connection or filesystem error):
+    {"action": "skipped" | "downloaded" | "failed", "dest_path": <str>,
+     "size": <bytes written or None>, "task_id": <str>, "task_name": <str>,
+     "extracted": <list of file paths or None>, "error": <str or None>}
+
+    A failed file is removed, its "size" being the bytes written before
+    it failed.
+
+    When extract is True, .gz/.zst files are decompressed and .tar archives
+    unpacked (see extract()) in a process pool, as each finishes downloading.
+
+    An aiohttp ClientSession may be passed in, otherwise one is created
+    and closed.  When given, progress(dest_path, nbytes) is called as
+    bytes are received (including any from hedged requests).
+    """
+    def result(action, task, dest_path, size, extracted=None, error=None):
+        return {"action": action, "dest_path": dest_path, "size": size,
+                "task_id": task["id"], "task_name": task["name"], "extracted": extracted,
+                "error": error}
+
+    def finished_result(art_file):
+        action = "failed" if art_file.failed else "downloaded"
+        return result(action, art_files[art_file], art_file.dest_path, art_file.written,
+                      art_file.extracted, art_file.error)
+
+    # Shared by all workers, so filesystem and network concurrency is bounded overall.
+    fs_pool = FSPool()
+    extractor = Extractor() if extract else None
+    limiter = AIMDLimiter(maximum=max_parallel, bandwidth=bandwidth)
+    finished = asyncio.Queue()
+    # Closes the session, only when not passed in
+    stack = AsyncExitStack()
+    # Python docs say to retain a reference to all tasks so they aren't
+    # "garbage-collected" while still active.
+    workers = set()
+    getter = None
+    work = []
+    art_files = dict()  # ArtifactFile -> task
+    try:
+        for task in tasks:
+            for art_url_sfx, size in task_art_files(task):
+                dest_path = unquote(art_url_sfx)  # Strip off URL encoding
+                if path_rx is None or bool(path_rx.search(dest_path)):
+                    ranges = segments(size, segment_size)
+                    art_file = ArtifactFile(dest_path, fs_pool, size, len(ranges))
+                    art_files[art_file] = task
+                    work.extend((art_file, start, end) for start, end in ranges)
+                else:
+                    yield result("skipped", task, dest_path, None)
+        if extractor is not None:
+            siblings = dict()  # task ID -> paths of its downloaded artifact files
+            for art_file, task in art_files.items():
+                siblings.setdefault(task["id"], set()).add(normpath(art_file.dest_path))
+            siblings = {task_id: frozenset(paths) for task_id, paths in siblings.items()}
+            for art_file, task in art_files.items():
+                art_file.siblings = siblings[task["id"]]
+        work = deque(schedule(work, policy))
+
+        if session is None:
+            session = await stack.enter_async_context(ClientSession())
+        workers = {asyncio.create_task(download_worker(session, work, limiter, finished,
+                                                       min_rate, file_timeout, progress,
+                                                       extractor))
+                   for _ in range(min(limiter.maximum, len(work)))}
+        deadline = limiter.now() + timeout if timeout else None
+        pending = len(art_files)
+        while pending:
+            if getter is None:
+                getter = asyncio.ensure_future(finished.get())
+            remaining = None if deadline is None else max(0.0, deadline - limiter.now())
+            done, _ = await asyncio.wait(workers | {getter}, timeout=remaining,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                log.warning(f"Timed out after {timeout} seconds")
+                break
+            for worker in done - {getter}:
+                workers.discard(worker)
+                worker.result()  # Raise any unexpected exception
+            if getter in done:
+                art_file = getter.result()
+                getter = None
+                pending -= 1
+                yield finished_result(art_file)
+
+        # Only reached with pending files after a timeout, all others have finished.
+        await _cancel(workers)
+        # Cancelled extractions are put in finished, marked failed.
+        await _cancel(_extractions(art_files))
+        while not finished.empty():
+            yield finished_result(finished.get_nowait())
+        for art_file, task in art_files.items():
+            if not art_file.closed:
+                art_file.failed = True
+                await art_file.close()
+                yield result("failed", task, art_file.dest_path, art_file.written,
+                             error=f"Timed out after {timeout} seconds")
+    finally:
+        # Also reached when the caller stops iterating early
+        await _cancel(workers | ({getter} if getter is not None else set()))
+        await _cancel(_extractions(art_files))
+        for art_file in art_files:
+            await art_file.close()
+        await stack.aclose()
+        fs_pool.shutdown()
+        if extractor is not None:
+            extractor.shutdown()
+
+
+def _extractions(art_files):
+    """Return the set of extract_file() tasks of art_files."""
+    return {art_file.extracting for art_file in art_files if art_file.extracting is not None}
+
+
+async def _cancel(aws):
+    """Cancel all asyncio tasks in aws and wait for them to finish."""
+    for aw in aws:
+        aw.cancel()
+    await asyncio.gather(*aws, return_exceptions=True)
+
+
+async def iter_build(buildId, path_rx=None, **dargs):  # noqa N803
+    """Like iter_download(), for all tasks of the given Cirrus-CI build ID."""
+    # GQL transport is blocking, don't hold up the caller's event loop.
+    loop = asyncio.get_running_loop()
+    tasks = await loop.run_in_executor(None, fetch_tasks, buildId)
+    async for result in iter_download(tasks, path_rx, **dargs):
+        yield result
+
+
+async def download(tasks, path_rx=None, callback=None, **dargs):
+    """
+    Return list of results dicts, one for each task with artifacts.
+
+    Each lists "downloaded", "skipped" and "failed" file paths.  Keyword
+    arguments are passed to iter_download().  When given,
+    callback(result) is called with each of its results.
+    """
+    results = dict()
+    for task in tasks:
+        if len(task["artifacts"]):
+            results[task["id"]] = {"downloaded": [], "skipped": [], "failed": []}
+    async for result in iter_download(tasks, path_rx, **dargs):
+        results[result["task_id"]][result["action"]].append(result["dest_path"])
+        if callback is not None:
+            callback(result)
+    return list(results.values())
+
+
+async def download_artifacts(task, path_rx=None, **dargs):
+    """Given a task dict, download all artifacts or matches to path_rx."""
+    results = await download([task], path_rx, **dargs)
+    if results:
+        return results[0]
+    return {"downloaded": [], "skipped": [], "failed": []}
 
 
 def get_args(argv):
@@ -124,38 +1189,121 @@ def get_args(argv):
                                          '/<File Path>'))
     parser.add_argument('-v', '--verbose',
                         dest='verbose', action='store_true', default=False,
-                        help='Show "Downloaded" | "Skipped" + relative artifact file-path.')
-    parser.add_argument('buildId', nargs=1, metavar='<Build ID>', type=int,
+                        help='Show "Downloaded" | "Skipping" + relative artifact file-path.')
+    parser.add_argument('-j', '--max-parallel',
+                        dest='max_parallel', type=int, default=MAX_PARALLEL, metavar='<N>',
+                        help=f"Upper limit on simultaneous downloads (default {MAX_PARALLEL}).")
+    parser.add_argument('--bwlimit',
+                        dest='bwlimit', type=int, default=None, metavar='<KiB/s>',
+                        help="Limit aggregate download bandwidth (KiB per second).")
+    parser.add_argument('--schedule',
+                        dest='schedule', choices=SCHEDULES, default=SCHEDULES[0],
+                        help=f"Download ordering by file size (default {SCHEDULES[0]}).")
+    parser.add_argument('--segment-size',
+                        dest='segment_mib', type=int, default=SEGMENT_SIZE // 1024**2,
+                        metavar='<MiB>',
+                        help=("Download larger files as parallel segments of this size"
+                              f" (default {SEGMENT_SIZE // 1024**2}, 0 disables)."))
+    parser.add_argument('--min-rate',
+                        dest='min_rate', type=int, default=MIN_RATE // 1024, metavar='<KiB/s>',
+                        help=("Hedge transfers slower than this with a duplicate request"
+                              f" (default {MIN_RATE // 1024}, 0 disables)."))
+    parser.add_argument('--file-timeout',
+                        dest='file_timeout', type=float, default=None, metavar='<seconds>',
+                        help="Give up on any file not downloaded within this time.")
+    parser.add_argument('--timeout',
+                        dest='timeout', type=float, default=None, metavar='<seconds>',
+                        help="Give up on all files not downloaded within this time.")
+    parser.add_argument('--extract',
+                        dest='extract', action='store_true', default=False,
+                        help=("Decompress .gz/.zst files and unpack .tar archives as they"
+                              " finish downloading, replacing them."))
+    parser.add_argument('--index',
+                        dest='index', default=None, metavar='<db-path>',
+                        help=("SQLite database of build/task timing and artifact sizes,"
+                              " for --ingest, --slowest and --largest."))
+    parser.add_argument('--ingest',
+                        dest='ingest', type=int, nargs='+', default=None, metavar='<Build ID>',
+                        help="Record builds in --index instead of downloading artifacts.")
+    parser.add_argument('--slowest',
+                        dest='slowest', type=int, default=None, metavar='<N>',
+                        help="Show the N slowest tasks from --index.")
+    parser.add_argument('--largest',
+                        dest='largest', type=int, default=None, metavar='<N>',
+                        help="Show the N largest artifact files from --index.")
+    parser.add_argument('--builds',
+                        dest='builds', type=int, default=INDEX_BUILDS, metavar='<N>',
+                        help=("Limit --slowest and --largest to the N most recently"
+                              f" created builds (default {INDEX_BUILDS})."))
+    parser.add_argument('buildId', nargs='?', metavar='<Build ID>', type=int,
                         help="A Cirrus-CI Build ID number.")
     parser.add_argument('path_rx', nargs='?', default=None, metavar='[Reg. Exp.]',
                         help="Reg. exp. include only <task>/<artifact>/<file-path> matches.")
-    return parser.parse_args(args=argv[1:])
+    args = parser.parse_args(args=argv[1:])
+    indexing = args.ingest or args.slowest or args.largest
+    if bool(indexing) != bool(args.index):
+        parser.error("--index requires one of --ingest, --slowest or --largest, and vice versa")
+    if args.slowest and args.largest:
+        # Their rows have different columns, don't mix them in one stream.
+        parser.error("--slowest and --largest may not be used together")
+    if not indexing and args.buildId is None:
+        parser.error("the following arguments are required: <Build ID>")
+    return args
 
 
-async def download(tasks, path_rx=None):
-    """Return results from all async operations."""
-    # Python docs say to retain a reference to all tasks so they aren't
-    # "garbage-collected" while still active.
-    results = []
-    for task in tasks:
-        if len(task["artifacts"]):
-            results.append(asyncio.create_task(download_artifacts(task, path_rx)))
-    await asyncio.gather(*results)
-    return results
+def show_result(result):
+    """Print a line describing an iter_download() result."""
+    dest_path = result["dest_path"]
+    if result["action"] == "downloaded":
+        print(f"  Downloaded '{dest_path}'")
+    elif result["action"] == "skipped":
+        print(f"    Skipping '{dest_path}'")
+    for extracted_path in result["extracted"] or ():
+        print(f"   Extracted '{extracted_path}'")
+    sys.stdout.flush()
+
 
+def index_main(db_path, ingest_ids=None, slowest=None, largest=None, builds=INDEX_BUILDS):
+    """Ingest builds into, then print --slowest/--largest rows from, the index at db_path."""
+    conn = open_index(db_path)
+    try:
+        if ingest_ids:
+            for bid in ingest(conn, ingest_ids):
+                log.info(f"Indexed build {bid}")
+        rows = []
+        if slowest:
+            rows = slowest_tasks(conn, slowest, builds)
+        elif largest:
+            rows = largest_files(conn, largest, builds)
+        for row in rows:
+            print("\t".join(str(col) for col in row))
+    finally:
+        conn.close()
 
-def main(buildId, path_rx=None):  # noqa: N803,D103
+
+def main(buildId, path_rx=None, verbose=False, loop=None, **dargs):  # noqa: N803,D103
     if path_rx is not None:
         path_rx = re.compile(path_rx)
-    transport = RequestsHTTPTransport(url=CCI_GQL_URL, verify=True, retries=3)
-    with GQLClient(transport=transport, fetch_schema_from_transport=True) as gqlclient:
-        tasks = get_tasks(gqlclient, buildId)
-    transport.close()
-    async_results = asyncio.run(download(tasks, path_rx))
-    return [r.result() for r in async_results]
+    tasks = fetch_tasks(buildId)
+    coro = download(tasks, path_rx, show_result if verbose else None, **dargs)
+    if loop is None:
+        return asyncio.run(coro)
+    return loop.run_until_complete(coro)
 
 
 if __name__ == "__main__":
     args = get_args(sys.argv)
-    VERBOSE = args.verbose
-    main(args.buildId[0], args.path_rx)
+    logging.basicConfig(format="{message}", style="{",
+                        level=logging.INFO if args.verbose else logging.WARNING)
+    if args.index:
+        index_main(args.index, args.ingest, args.slowest, args.largest, args.builds)
+    else:
+        main(args.buildId, args.path_rx, args.verbose,
+             max_parallel=args.max_parallel,
+             bandwidth=args.bwlimit * 1024 if args.bwlimit else None,
+             policy=args.schedule,
+             segment_size=args.segment_mib * 1024**2,
+             min_rate=args.min_rate * 1024,
+             file_timeout=args.file_timeout,
+             timeout=args.timeout,
+             extract=args.extract)
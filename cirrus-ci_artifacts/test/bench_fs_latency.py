@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark downloads to a slow filesystem, against blocking in-loop writes.
+
+Every blocking filesystem call sleeps for the given latency (seconds),
+simulating a throttled disk.  The "inloop" case opens and writes each
+file directly in its coroutine, as cirrus-ci_artifacts.py did before
+FSPool (though one chunk at a time, not the whole response at once).
+The "fspool" case downloads through ArtifactFile and FSPool.  Both
+stream from a fake response, with all downloads running at once, and
+report total time along with the longest event-loop stall seen by a
+1ms heartbeat.
+
+Usage: bench_fs_latency.py [<latency>...]
+"""
+
+import asyncio
+import sys
+import time
+from os import makedirs, urandom
+from os.path import join, split
+from tempfile import TemporaryDirectory
+
+import ccia
+
+FILES = 16
+CHUNKS = 8
+DATA = urandom(ccia.CHUNK_SIZE)
+
+
+class FakeSession:
+    """Stand-in for an aiohttp ClientSession, streaming CHUNKS chunks per file."""
+
+    def get(self, *args, **dargs):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return None
+
+    status = 200
+
+    @property
+    def content(self):
+        return self
+
+    async def iter_chunked(self, size):
+        for _ in range(CHUNKS):
+            await asyncio.sleep(0.005)  # Network time between chunks
+            yield DATA
+
+
+async def heartbeat(stop, stalls):
+    """Append how late each 1ms sleep wakes up, until stop is set."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        began = loop.time()
+        await asyncio.sleep(0.001)
+        stalls.append(loop.time() - began - 0.001)
+
+
+async def inloop(session, dest_path, latency):
+    """Download like the original code, with blocking calls in the coroutine."""
+    makedirs(split(dest_path)[0], exist_ok=True)
+    async with session.get(dest_path) as response:
+        time.sleep(latency)
+        with open(dest_path, "wb") as dest_file:
+            async for chunk in response.content.iter_chunked(ccia.CHUNK_SIZE):
+                time.sleep(latency)
+                dest_file.write(chunk)
+
+
+async def fspool(session, dest_paths, latency):
+    """Download through ArtifactFile, with FSPool calls slowed by latency."""
+    pwrite_all, open_dest = ccia._pwrite_all, ccia._open_dest
+    ccia._pwrite_all = lambda *args: (time.sleep(latency), pwrite_all(*args))[1]
+    ccia._open_dest = lambda *args: (time.sleep(latency), open_dest(*args))[1]
+    fs_pool = ccia.FSPool()
+    limiter = ccia.AIMDLimiter(initial=FILES, maximum=FILES)
+    art_files = [ccia.ArtifactFile(dest_path, fs_pool, CHUNKS * ccia.CHUNK_SIZE)
+                 for dest_path in dest_paths]
+    try:
+        await asyncio.gather(*[ccia.download_artifact(session, "fake://url", art_file,
+                                                      limiter=limiter)
+                               for art_file in art_files])
+        await asyncio.gather(*[art_file.segment_done() for art_file in art_files])
+    finally:
+        fs_pool.shutdown()
+        ccia._pwrite_all, ccia._open_dest = pwrite_all, open_dest
+
+
+async def measure(case, dirpath, latency):
+    """Return (total seconds, longest stall seconds) downloading FILES files."""
+    dest_paths = [join(dirpath, case, str(n), "file") for n in range(FILES)]
+    stop = asyncio.Event()
+    stalls = []
+    monitor = asyncio.create_task(heartbeat(stop, stalls))
+    began = time.perf_counter()
+    if case == "inloop":
+        await asyncio.gather(*[inloop(FakeSession(), dest_path, latency)
+                               for dest_path in dest_paths])
+    else:
+        await fspool(FakeSession(), dest_paths, latency)
+    total = time.perf_counter() - began
+    stop.set()
+    await monitor
+    return total, max(stalls)
+
+
+def main(latencies):
+    """Print a row of measurements for each latency."""
+    print("latency  inloop total/stall  fspool total/stall")
+    for latency in latencies:
+        row = [f"{latency * 1000:.0f}ms/op"]
+        for case in ("inloop", "fspool"):
+            with TemporaryDirectory(prefix="bench_ccia_") as dirpath:
+                total, stall = asyncio.run(measure(case, dirpath, latency))
+            row.append(f"{total:.2f}s / {stall * 1000:.0f}ms")
+        print("  ".join(row))
+
+
+if __name__ == "__main__":
+    main([float(arg) for arg in sys.argv[1:]] or [0.01, 0.02, 0.05])
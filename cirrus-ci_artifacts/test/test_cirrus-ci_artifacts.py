@@ -3,14 +3,20 @@
 """Verify contents of .cirrus.yml meet specific expectations."""
 
 import asyncio
+import gzip
+import io
 import os
 import re
+import tarfile
+import time
 import unittest
 from contextlib import redirect_stderr, redirect_stdout
 from io import StringIO
 from tempfile import TemporaryDirectory
 from unittest.mock import MagicMock, mock_open, patch
 
+from aiohttp import ClientPayloadError, ClientResponseError
+
 import ccia
 
 import yaml
@@ -43,7 +49,6 @@ class TestBase(unittest.TestCase):
     FAKE_API = "smb://fake.url.invalid/artifact"
 
     def setUp(self):
-        ccia.VERBOSE = True
         patch('ccia.CCI_GQL_URL', new=self.FAKE_CCI).start()
         patch('ccia.CCI_ART_URL', new=self.FAKE_API).start()
         self.addCleanup(patch.stopall)
@@ -115,18 +120,629 @@ class TestUtils(TestBase):
                 # N/B: This makes debugging VERY difficult, comment out for pdb use
                 fake_stdout = StringIO()
                 fake_stderr = StringIO()
+                results = []
                 with redirect_stderr(fake_stderr), redirect_stdout(fake_stdout):
-                    asyncio.run(ccia.download_artifacts(test_task))
+                    actual = asyncio.run(ccia.download_artifacts(test_task,
+                                                                 callback=results.append))
                 self.assertEqual(fake_stderr.getvalue(), '')
-                for line in fake_stdout.getvalue().splitlines():
-                    with self.subTest(line=line):
-                        self.assertRegex(line.strip(), self.TEST_URL_RX)
+                self.assertEqual(fake_stdout.getvalue(), '')
+                self.assertEqual(len(results), 7)
+                self.assertEqual(len(actual["downloaded"]), 7)
+                for result in results:
+                    with self.subTest(result=result):
+                        self.assertEqual(result["action"], "downloaded")
+                        self.assertEqual(result["task_name"], test_task["name"])
+                        self.assertRegex(result["dest_path"], self.TEST_URL_RX)
+
+    def test_iter_download(self):
+        self.session = MagicMock()
+        self.session.get.side_effect = lambda *args, **dargs: FakeResponse()
+        progress = []
+
+        async def _iter_download():
+            with TemporaryDirectory(prefix="test_ccia_tmp") as tmp:
+                cwd = os.getcwd()
+                os.chdir(tmp)
+                try:
+                    return [result async for result in ccia.iter_download(
+                        self.TEST_TASKS, re.compile("test_art-[12]"), session=self.session,
+                        progress=lambda dest_path, nbytes: progress.append(nbytes))]
+                finally:
+                    os.chdir(cwd)
+
+        results = asyncio.run(_iter_download())
+        actions = [result["action"] for result in results]
+        self.assertEqual(actions.count("skipped"), 2)
+        self.assertEqual(actions.count("downloaded"), 12)
+        # Skipped files are reported before any downloads
+        self.assertEqual(actions[:2], ["skipped", "skipped"])
+        for result in results[2:]:
+            self.assertEqual(result["size"], 9)
+        self.assertEqual(sum(progress), 12 * 9)
+        # A caller-owned session isn't closed
+        self.session.close.assert_not_called()
+
+
+class FakeResponse:
+
+    chunks = [b"foo", b"bar", b"baz"]
+
+    def __init__(self, status=200, headers=None, chunks=None, delay=0, error=None,
+                 header_delay=0):
+        """Fake aiohttp response context manager, streaming chunks every delay seconds."""
+        self.header_delay = header_delay
+        self.status = status
+        self.headers = headers or {}
+        if chunks is not None:
+            self.chunks = chunks
+        self.delay = delay
+        # Raised after streaming chunks, when given
+        self.error = error
+
+    def raise_for_status(self):
+        raise ClientResponseError(MagicMock(), (), status=self.status)
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.header_delay)
+        return self
+
+    async def __aexit__(self, *args):
+        return None
+
+    @property
+    def content(self):
+        return self
+
+    async def iter_chunked(self, size):
+        for chunk in self.chunks:
+            await asyncio.sleep(self.delay)
+            yield chunk
+        if self.error is not None:
+            raise self.error
+
+
+class TestDownloadArtifact(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = TemporaryDirectory(prefix="test_ccia_tmp")
+        self.addCleanup(self.tmp.cleanup)
+        self.session = MagicMock()
+        self.session.get.return_value = FakeResponse()
+
+    def download(self, dest_path, size, segment_size=None):
+        async def _download():
+            fs_pool = ccia.FSPool(max_workers=2)
+            ranges = ccia.segments(size, segment_size)
+            art_file = ccia.ArtifactFile(dest_path, fs_pool, size, len(ranges))
+            try:
+                await asyncio.gather(*[ccia.download_artifact(self.session, "fake://url",
+                                                              art_file, start, end)
+                                       for start, end in ranges])
+                for _ in ranges:
+                    done = await art_file.segment_done()
+                self.assertTrue(done)
+            finally:
+                fs_pool.shutdown()
+        asyncio.run(_download())
+
+    def fake_ranged_get(self, content, honor_range=True):
+        def _get(url, headers):
+            if "Range" not in headers or not honor_range:
+                return FakeResponse(chunks=[content[i:i + 4] for i in range(0, len(content), 4)])
+            first, last = headers["Range"].replace("bytes=", "").split("-")
+            return FakeResponse(206, chunks=[content[int(first):int(last) + 1]])
+        return _get
+
+    def test_download_artifact(self):
+        for size in (None, 0, 9, 1024):
+            dest_path = os.path.join(self.tmp.name, str(size), "art", "file")
+            with self.subTest(size=size):
+                self.download(dest_path, size)
+                with open(dest_path, "rb") as dest_file:
+                    self.assertEqual(dest_file.read(), b"".join(FakeResponse.chunks))
+
+    def test_download_segments(self):
+        content = bytes(range(100))
+        for honor_range in (True, False):
+            dest_path = os.path.join(self.tmp.name, str(honor_range), "file")
+            with self.subTest(honor_range=honor_range):
+                self.session.get.side_effect = self.fake_ranged_get(content, honor_range)
+                self.download(dest_path, len(content), segment_size=30)
+                self.assertEqual(self.session.get.call_count, 4)
+                self.session.get.reset_mock()
+                with open(dest_path, "rb") as dest_file:
+                    self.assertEqual(dest_file.read(), content)
+
+    def test_makedirs_once(self):
+        dirpath = os.path.join(self.tmp.name, "some", "dir")
+
+        async def _makedirs():
+            fs_pool = ccia.FSPool()
+            try:
+                await asyncio.gather(*[fs_pool.makedirs(dirpath) for _ in range(10)])
+            finally:
+                fs_pool.shutdown()
+
+        with patch('ccia.makedirs') as mock_makedirs:
+            asyncio.run(_makedirs())
+        mock_makedirs.assert_called_once_with(dirpath, exist_ok=True)
+
+    def test_retry_overloaded(self):
+        dest_path = os.path.join(self.tmp.name, "retry", "file")
+        self.session.get.side_effect = [FakeResponse(429, {"Retry-After": "0"}),
+                                        FakeResponse(503, {"Retry-After": "0"}),
+                                        FakeResponse()]
+        self.download(dest_path, None)
+        self.assertEqual(self.session.get.call_count, 3)
+        with open(dest_path, "rb") as dest_file:
+            self.assertEqual(dest_file.read(), b"".join(FakeResponse.chunks))
+
+    def test_client_error(self):
+        for status in (403, 404, 410):
+            dest_path = os.path.join(self.tmp.name, str(status), "file")
+            with self.subTest(status=status):
+                self.session.get.side_effect = [FakeResponse(status)]
+                with self.assertRaises(ClientResponseError):
+                    self.download(dest_path, None)
+                self.assertFalse(os.path.exists(dest_path))
+
+
+class TestHedging(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = TemporaryDirectory(prefix="test_ccia_tmp")
+        self.addCleanup(self.tmp.cleanup)
+        self.session = MagicMock()
+        patch('ccia.RATE_WINDOW', new=0.05).start()
+        patch('ccia.RATE_INTERVAL', new=0.01).start()
+
+    def hedged(self, dest_path, coro_func):
+        async def _hedged():
+            fs_pool = ccia.FSPool(max_workers=2)
+            art_file = ccia.ArtifactFile(dest_path, fs_pool)
+            try:
+                await coro_func(art_file)
+                self.assertTrue(await art_file.segment_done())
+            finally:
+                fs_pool.shutdown()
+        asyncio.run(_hedged())
+
+    def test_throughput(self):
+        throughput = ccia.Throughput(window=10)
+        self.assertIsNone(throughput.rate(0))
+        throughput(0)
+        self.assertIsNone(throughput.rate(0))
+        throughput(100)
+        self.assertIsNone(throughput.rate(5))
+        throughput(100)
+        self.assertEqual(throughput.rate(10), 20.0)
+        throughput(1000)
+        self.assertEqual(throughput.rate(20), 100.0)
+
+    def test_hedge_stalled(self):
+        dest_path = os.path.join(self.tmp.name, "hedged", "file")
+        self.session.get.side_effect = [FakeResponse(delay=10), FakeResponse()]
+
+        async def download(art_file):
+            await ccia.hedged_download(self.session, "fake://url", art_file, min_rate=1024)
+
+        self.hedged(dest_path, download)
+        self.assertEqual(self.session.get.call_count, 2)
+        with open(dest_path, "rb") as dest_file:
+            self.assertEqual(dest_file.read(), b"".join(FakeResponse.chunks))
+
+    def test_hedge_stalled_headers(self):
+        dest_path = os.path.join(self.tmp.name, "hedged_headers", "file")
+        self.session.get.side_effect = [FakeResponse(header_delay=10), FakeResponse()]
+
+        async def download(art_file):
+            await ccia.hedged_download(self.session, "fake://url", art_file, min_rate=1024)
+
+        self.hedged(dest_path, download)
+        self.assertEqual(self.session.get.call_count, 2)
+        with open(dest_path, "rb") as dest_file:
+            self.assertEqual(dest_file.read(), b"".join(FakeResponse.chunks))
+
+    def test_no_hedge(self):
+        dest_path = os.path.join(self.tmp.name, "unhedged", "file")
+        self.session.get.side_effect = [FakeResponse(delay=0.05)]
+
+        async def download(art_file):
+            await ccia.hedged_download(self.session, "fake://url", art_file, min_rate=0)
+
+        self.hedged(dest_path, download)
+        self.assertEqual(self.session.get.call_count, 1)
+
+    def test_file_timeout(self):
+        dest_path = os.path.join(self.tmp.name, "timeout", "file")
+        self.session.get.side_effect = [FakeResponse(delay=10)]
+        finished = asyncio.Queue()
+
+        async def download(art_file):
+            work = ccia.deque([(art_file, 0, None)])
+            art_file.segments = 2  # Don't let the worker close the file
+            await ccia.download_worker(self.session, work, ccia.AIMDLimiter(), finished,
+                                       min_rate=0, file_timeout=0.05)
+            self.assertTrue(art_file.failed)
+            self.assertTrue(finished.empty())
+
+        with self.assertLogs(ccia.log, "WARNING") as logs:
+            self.hedged(dest_path, download)
+        self.assertRegex(logs.output[0], "Timed out downloading")
+
+    def test_slow_open_timeout(self):
+        dest_path = os.path.join(self.tmp.name, "slow_open", "file")
+        self.session.get.side_effect = [FakeResponse()]
+        finished = asyncio.Queue()
+        opened = []
+
+        def slow_open_dest(*args):
+            time.sleep(0.3)
+            opened.append(open_dest(*args))
+            return opened[-1]
+
+        async def download(art_file):
+            work = ccia.deque([(art_file, 0, None)])
+            art_file.segments = 2  # Leave the last segment_done() to hedged()
+            await ccia.download_worker(self.session, work, ccia.AIMDLimiter(), finished,
+                                       min_rate=0, file_timeout=0.05)
+            self.assertTrue(art_file.failed)
+
+        open_dest = ccia._open_dest
+        with patch('ccia._open_dest', new=slow_open_dest), \
+                self.assertLogs(ccia.log, "WARNING") as logs:
+            self.hedged(dest_path, download)
+        self.assertRegex(logs.output[0], "Timed out downloading")
+        self.assertTrue(opened[0].closed)
+
+    def test_global_timeout(self):
+        self.session.get.side_effect = lambda *args, **dargs: FakeResponse(delay=10)
+        tasks = [{"name": "task", "id": "1", "buildId": "2",
+                  "artifacts": [{"name": "art", "files": [{"path": "file", "size": 9}]}]}]
+
+        async def _iter_download():
+            return [result async for result in ccia.iter_download(
+                tasks, session=self.session, min_rate=0, timeout=0.05)]
+
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        try:
+            with self.assertLogs(ccia.log, "WARNING") as logs:
+                results = asyncio.run(_iter_download())
+        finally:
+            os.chdir(cwd)
+        self.assertRegex(logs.output[0], "Timed out after")
+        self.assertEqual([result["action"] for result in results], ["failed"])
+
+    def test_file_errors(self):
+        responses = dict(good=lambda: FakeResponse(), missing=lambda: FakeResponse(404),
+                         truncated=lambda: FakeResponse(error=ClientPayloadError("reset")))
+        self.session.get.side_effect = lambda url, headers: responses[url.rsplit("/", 1)[1]]()
+        tasks = [{"name": "task", "id": "1", "buildId": "2",
+                  "artifacts": [{"name": "art", "files": [{"path": path, "size": None}
+                                                          for path in responses]}]}]
+
+        async def _iter_download():
+            return [result async for result in ccia.iter_download(
+                tasks, session=self.session, min_rate=0)]
+
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        try:
+            with self.assertLogs(ccia.log, "WARNING") as logs:
+                results = asyncio.run(_iter_download())
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(len(logs.output), 2)
+        results = {result["dest_path"]: result for result in results}
+        self.assertEqual(results["2/task/art/good"]["action"], "downloaded")
+        self.assertIsNone(results["2/task/art/good"]["error"])
+        for path, error in (("missing", "404"), ("truncated", "reset")):
+            with self.subTest(path=path):
+                self.assertEqual(results[f"2/task/art/{path}"]["action"], "failed")
+                self.assertIn(error, results[f"2/task/art/{path}"]["error"])
+                self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "2/task/art", path)))
+
+    def test_failed_segment(self):
+        content = bytes(range(1, 101))
+
+        def get(url, headers):
+            first, last = headers["Range"].replace("bytes=", "").split("-")
+            if first == "0":
+                return FakeResponse(206, chunks=[content[:10]], error=ClientPayloadError("reset"))
+            return FakeResponse(206, chunks=[content[int(first):int(last) + 1]])
+
+        self.session.get.side_effect = get
+        tasks = [{"name": "task", "id": "1", "buildId": "2",
+                  "artifacts": [{"name": "art", "files": [{"path": "file", "size": 100}]}]}]
+
+        async def _iter_download():
+            return [result async for result in ccia.iter_download(
+                tasks, session=self.session, min_rate=0, segment_size=30)]
+
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        try:
+            with self.assertLogs(ccia.log, "WARNING"):
+                results = asyncio.run(_iter_download())
+        finally:
+            os.chdir(cwd)
+        self.assertEqual([(result["action"], result["size"]) for result in results],
+                         [("failed", 80)])
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "2/task/art/file")))
+
+
+class TestExtract(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = TemporaryDirectory(prefix="test_ccia_tmp")
+        self.addCleanup(self.tmp.cleanup)
+        self.dirpath = os.path.join(self.tmp.name, "build", "task", "art")
+        os.makedirs(self.dirpath)
+
+    def path(self, *names):
+        return os.path.join(self.dirpath, *names)
+
+    def make_tar(self, filename, members, mode="w"):
+        with tarfile.open(self.path(filename), mode) as archive:
+            for name, data in members.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+
+    def read(self, *names):
+        with open(self.path(*names), "rb") as extracted:
+            return extracted.read()
+
+    def test_extract(self):
+        with gzip.open(self.path("log.txt.gz"), "wb") as gz_file:
+            gz_file.write(b"foo" * 1000)
+        self.assertEqual(ccia.extract(self.path("log.txt.gz")), [self.path("log.txt")])
+        self.assertEqual(self.read("log.txt"), b"foo" * 1000)
+
+        self.make_tar("logs.tar.gz", {"logs/a": b"a", "logs/b": b"bb"}, mode="w:gz")
+        self.make_tar("more.tar", {"c": b"ccc"})
+        self.assertEqual(ccia.extract(self.path("logs.tar.gz")),
+                         [self.path("logs", "a"), self.path("logs", "b")])
+        self.assertEqual(ccia.extract(self.path("more.tar")), [self.path("c")])
+        self.assertEqual(self.read("logs", "b"), b"bb")
+        self.assertEqual(sorted(os.listdir(self.dirpath)), ["c", "log.txt", "logs"])
+
+    def test_extract_unsafe(self):
+        self.make_tar("evil.tar", {"../evil": b"evil"})
+        with self.assertRaises(tarfile.TarError):
+            ccia.extract(self.path("evil.tar"))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "build", "task", "evil")))
+        self.assertTrue(os.path.exists(self.path("evil.tar")))
+
+    def test_extractable(self):
+        self.assertTrue(ccia.extractable("a/b.tgz"))
+        self.assertFalse(ccia.extractable("a/b.txt"))
+        with patch('ccia.zstandard', new=None):
+            self.assertFalse(ccia.extractable("a/b.zst"))
+
+    def iter_download_extract(self, files, content, **dargs):
+        session = MagicMock()
+        task = dict(id="1", name="task", buildId="build",
+                    artifacts=[dict(name="art", files=[dict(path=path, size=size)
+                                                       for path, size in files.items()])])
+
+        def get(url, headers):
+            data = content[url.rsplit("/", 1)[1]]
+            if "Range" not in headers:
+                return FakeResponse(chunks=[data[:5], data[5:]])
+            first, last = headers["Range"].replace("bytes=", "").split("-")
+            return FakeResponse(206, chunks=[data[int(first):int(last) + 1]])
+
+        session.get.side_effect = get
+
+        async def _iter_download():
+            cwd = os.getcwd()
+            os.chdir(self.tmp.name)
+            try:
+                return {result["dest_path"]: result async for result in ccia.iter_download(
+                    [task], session=session, extract=True, **dargs)}
+            finally:
+                os.chdir(cwd)
+
+        with self.assertLogs("cirrus-ci_artifacts", level="WARNING"):
+            return asyncio.run(_iter_download())
+
+    def test_iter_download_extract(self):
+        content = {"log.gz": gzip.compress(b"foo"), "bad.gz": b"not gzip", "plain": b"plain"}
+        # Whole files are streamed into extraction, never written to disk.
+        with patch('ccia._open_dest', side_effect=ccia._open_dest) as open_dest:
+            results = self.iter_download_extract(dict.fromkeys(content), content)
+        open_dest.assert_called_once_with("build/task/art/plain", None)
+        self.assertEqual(results["build/task/art/log.gz"]["extracted"], ["build/task/art/log"])
+        self.assertEqual(results["build/task/art/log.gz"]["size"], len(content["log.gz"]))
+        self.assertEqual(results["build/task/art/bad.gz"]["action"], "failed")
+        self.assertRegex(results["build/task/art/bad.gz"]["error"], "Extraction failed")
+        self.assertEqual(results["build/task/art/plain"]["action"], "downloaded")
+        self.assertIsNone(results["build/task/art/plain"]["extracted"])
+        self.assertEqual(sorted(os.listdir(self.dirpath)), ["log", "plain"])
+        self.assertEqual(self.read("log"), b"foo")
+
+    def test_iter_download_extract_segments(self):
+        content = {"log.gz": gzip.compress(b"foo" * 100), "bad.gz": b"not gzip at all"}
+        files = {path: len(data) for path, data in content.items()}
+        # Segmented files are extracted once downloaded, a failure keeps the download.
+        results = self.iter_download_extract(files, content, segment_size=10)
+        self.assertEqual(results["build/task/art/log.gz"]["extracted"], ["build/task/art/log"])
+        self.assertEqual(results["build/task/art/bad.gz"]["action"], "failed")
+        self.assertEqual(sorted(os.listdir(self.dirpath)), ["bad.gz", "log"])
+        self.assertEqual(self.read("log"), b"foo" * 100)
+
+    def test_iter_download_extract_collision(self):
+        content = {"log.gz": gzip.compress(b"extracted"), "log": b"artifact",
+                   "logs.tar": b""}
+        self.make_tar("logs.tar", {"log": b"member"})
+        with open(self.path("logs.tar"), "rb") as tar_file:
+            content["logs.tar"] = tar_file.read()
+        os.remove(self.path("logs.tar"))
+        results = self.iter_download_extract(dict.fromkeys(content), content)
+        for path in ("log.gz", "logs.tar"):
+            with self.subTest(path=path):
+                self.assertEqual(results[f"build/task/art/{path}"]["action"], "failed")
+                self.assertRegex(results[f"build/task/art/{path}"]["error"],
+                                 "Refusing to overwrite artifact file")
+        self.assertEqual(self.read("log"), b"artifact")
+
+
+class TestSchedule(unittest.TestCase):
+
+    def test_segments(self):
+        for size, segment_size, expected in ((None, 10, [(0, None)]),
+                                             (0, 10, [(0, None)]),
+                                             (10, 10, [(0, None)]),
+                                             (10, 0, [(0, None)]),
+                                             (25, 10, [(0, 10), (10, 20), (20, 25)])):
+            with self.subTest(size=size, segment_size=segment_size):
+                self.assertEqual(ccia.segments(size, segment_size), expected)
+
+    def test_schedule(self):
+        art_files = [ccia.ArtifactFile(f"f{size}", None, size) for size in (5, None, 100, 20)]
+        work = [(art_file, 0, None) for art_file in art_files]
+        # A segment of the 100-byte file
+        work.append((art_files[2], 90, 100))
+        for policy, expected in (("largest", [100, 20, 10, 5, None]),
+                                 ("smallest", [None, 5, 10, 20, 100]),
+                                 ("listed", [5, None, 100, 20, 10])):
+            with self.subTest(policy=policy):
+                actual = [end - start if end else art_file.size
+                          for art_file, start, end in ccia.schedule(work, policy)]
+                self.assertEqual(actual, expected)
+        self.assertRaises(ValueError, ccia.schedule, work, "bogus")
+
+
+class TestAIMDLimiter(unittest.TestCase):
+
+    def run_limiter(self, coro_func, **dargs):
+        async def _run():
+            limiter = ccia.AIMDLimiter(**dargs)
+            await coro_func(limiter)
+            return limiter
+        return asyncio.run(_run())
+
+    def test_increase_with_throughput(self):
+        async def rounds(limiter):
+            for nbytes in (1, 2, 4):
+                for _ in range(limiter.limit):
+                    async with limiter:
+                        await asyncio.sleep(0.001)
+                        limiter.success(0.01, nbytes)
+
+        limiter = self.run_limiter(rounds, initial=2, maximum=8)
+        self.assertEqual(limiter.limit, 5)
+
+    def test_backoff_halves(self):
+        async def overload(limiter):
+            limiter.backoff(0.5)
+            # Subsequent backoff within DECREASE_INTERVAL is ignored
+            limiter.backoff(0.5)
+            self.assertGreater(limiter._resume_at, limiter.now())
+
+        limiter = self.run_limiter(overload, initial=8)
+        self.assertEqual(limiter.limit, 4)
+
+    def test_backoff_minimum(self):
+        async def overload(limiter):
+            limiter.backoff(0)
+
+        limiter = self.run_limiter(overload, initial=1, minimum=1)
+        self.assertEqual(limiter.limit, 1)
+
+    def test_rising_latency(self):
+        async def slow(limiter):
+            for latency in (0.1, 0.1, 0.5, 0.5):
+                limiter.success(latency, 1)
+
+        limiter = self.run_limiter(slow, initial=2)
+        self.assertEqual(limiter.limit, 1)
+
+    def test_retry_delay(self):
+        for headers, attempt, expected in (({}, 0, ccia.RETRY_DELAY),
+                                           ({}, 2, ccia.RETRY_DELAY * 4),
+                                           ({"Retry-After": "7"}, 3, 7.0),
+                                           ({"Retry-After": "bogus"}, 1, ccia.RETRY_DELAY * 2),
+                                           ({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"},
+                                            0, 0.0)):
+            with self.subTest(headers=headers, attempt=attempt):
+                actual = ccia.retry_delay(FakeResponse(429, headers), attempt)
+                self.assertEqual(actual, expected)
+
+
+class TestIndex(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.conn = ccia.open_index(":memory:")
+        self.addCleanup(self.conn.close)
+        self.execute = MagicMock(side_effect=self.fake_execute)
+        fake_client = MagicMock()
+        fake_client.__enter__.return_value.execute = self.execute
+        patch('ccia.gql_client', return_value=fake_client).start()
+        self.statuses = {"1": "COMPLETED", "2": "FAILED", "3": "EXECUTING"}
+
+    def make_build(self, bid):
+        tasks = []
+        for n, task in enumerate(TestUtils.TEST_TASKS):
+            tasks.append(dict(task, id=f"{bid}{task['id']}", buildId=bid,
+                              status="COMPLETED", durationInSeconds=int(bid) * 10 + n))
+        tasks[0]["artifacts"] = [dict(name="big", files=[dict(path="log", size=int(bid) * 100)])]
+        return dict(id=bid, status=self.statuses[bid], buildCreatedTimestamp=int(bid), tasks=tasks)
+
+    def fake_execute(self, query, variable_values):
+        return {"build": self.make_build(str(variable_values["buildId"]))}
+
+    def count(self, table):
+        return self.conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+    def test_ingest_once(self):
+        self.assertEqual(ccia.ingest(self.conn, [1, 2, 3]), [1, 2, 3])
+        self.assertEqual(self.execute.call_count, 3)
+        counts = [self.count(table) for table in ("builds", "tasks", "files")]
+        self.assertEqual(counts, [3, 6, 24])
+        # Only the still-executing build is queried again, and upserted in place.
+        self.statuses["3"] = "COMPLETED"
+        self.assertEqual(ccia.ingest(self.conn, [1, 2, 3]), [3])
+        self.assertEqual(ccia.ingest(self.conn, [1, 2, 3]), [])
+        self.assertEqual(self.execute.call_count, 4)
+        self.assertEqual([self.count(table) for table in ("builds", "tasks", "files")], counts)
+
+    def test_ingest_unknown(self):
+        def fake_execute(query, variable_values):
+            bid = str(variable_values["buildId"])
+            return {"build": None if bid == "2" else self.make_build(bid)}
+
+        self.execute.side_effect = fake_execute
+        with self.assertLogs(ccia.log, "WARNING") as logs:
+            self.assertEqual(ccia.ingest(self.conn, [1, 2, 3]), [1, 3])
+        self.assertRegex(logs.output[0], "Skipping build 2: No Cirrus-CI build found")
+        self.assertEqual(self.count("builds"), 2)
+
+    def test_slowest_largest_exclusive(self):
+        argv = ["ccia", "--index", "x.db", "--slowest", "1", "--largest", "1"]
+        with redirect_stderr(StringIO()) as stderr, self.assertRaises(SystemExit):
+            ccia.get_args(argv)
+        self.assertIn("--slowest and --largest may not be used together", stderr.getvalue())
+
+    def test_queries(self):
+        ccia.ingest(self.conn, [1, 2, 3])
+        self.assertEqual(ccia.slowest_tasks(self.conn, 3),
+                         [(31, "COMPLETED", "3", "task_2"), (30, "COMPLETED", "3", "task_1"),
+                          (21, "COMPLETED", "2", "task_2")])
+        self.assertEqual(ccia.largest_files(self.conn, 2, builds=2),
+                         [(300, "3/task_1/big/log"), (200, "2/task_1/big/log")])
+        self.assertEqual(len(ccia.largest_files(self.conn, 100, builds=1)), 8)
 
 
 class TestMain(unittest.TestCase):
 
     def setUp(self):
-        ccia.VERBOSE = True
         try:
             self.bid = os.environ["CIRRUS_BUILD_ID"]
         except KeyError:
@@ -162,7 +778,7 @@ class TestMain(unittest.TestCase):
         with redirect_stderr(fake_stderr), redirect_stdout(fake_stdout):
             import warnings
             warnings.filterwarnings("ignore", category=DeprecationWarning)
-            results = ccia.main(self.bid)
+            results = ccia.main(self.bid, verbose=True)
         self.assertEqual(fake_stderr.getvalue(), '')
         for line in fake_stdout.getvalue().splitlines():
             with self.subTest(line=line):
@@ -181,7 +797,7 @@ class TestMain(unittest.TestCase):
         fake_stdout = StringIO()
         fake_stderr = StringIO()
         with redirect_stderr(fake_stderr), redirect_stdout(fake_stdout):
-            results = ccia.main(self.bid, r"this-will-match-nothing")
+            results = ccia.main(self.bid, r"this-will-match-nothing", verbose=True)
         for line in fake_stdout.getvalue().splitlines():
             with self.subTest(line=line):
                 s_line = line.lower().strip()
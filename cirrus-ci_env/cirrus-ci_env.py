@@ -3,13 +3,36 @@
 """Utility to provide canonical listing of Cirrus-CI tasks and env. vars."""
 
 import argparse
+import bisect
+import csv
+import glob
+import hashlib
+import json
 import logging
+import os
 import re
+import socket
+import socketserver
+import stat
 import sys
+from collections import ChainMap
+from collections.abc import Mapping as MappingABC
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, product
 from traceback import extract_stack
-from typing import Any, Mapping
+from typing import Any, Iterator, Mapping, Optional
 
-import yaml
+# Seconds a client waits on the --serve daemon before rendering in-process
+DAEMON_TIMEOUT = 5
+
+# Maximum number of processes rendering --scan config. files, None for one per CPU
+SCAN_WORKERS = None
+
+# File name searched for in directories given to --scan
+CFG_FILENAME = ".cirrus.yml"
+
+# How --uses-image matches image names, the first is the default.
+MATCHES = ("exact", "prefix", "regex")
 
 
 def dbg(msg: str) -> None:
@@ -25,6 +48,34 @@ def err(msg: str) -> None:
     sys.exit(1)
 
 
+def load_yaml(stream) -> Any:
+    """Parse YAML from stream, importing PyYAML only when needed."""
+    # Deferred so --serve clients don't pay for importing it
+    import yaml
+    return yaml.safe_load(stream)
+
+
+def load_durations(stream) -> Mapping[str, float]:
+    """
+    Return dict of task name or alias to duration, parsed from stream.
+
+    JSON input is an object mapping names to durations.  Otherwise,
+    CSV rows of name and duration are expected, skipping any row (i.e.
+    a header) whose duration isn't a number.
+    """
+    if stream.name.endswith(".json"):
+        return {name: float(duration) for name, duration in json.load(stream).items()}
+    durations = dict()
+    for row in csv.reader(stream):
+        if len(row) < 2:
+            continue
+        try:
+            durations[row[0].strip()] = float(row[1])
+        except ValueError:
+            dbg(f"Skipping durations row {row}")
+    return durations
+
+
 class DefFmt(dict):
     """
     Defaulting-dict helper class for render_env()'s str.format_map().
@@ -40,6 +91,106 @@ class DefFmt(dict):
         return "${{{0}}}".format(key)
 
 
+def intern(value: Any) -> Any:
+    """Return the canonical instance of string values, so duplicates share memory."""
+    if type(value) is str:
+        return sys.intern(value)
+    return value
+
+
+def has_matrix(value: Any) -> bool:
+    """Return True if value, or any value nested within it, has a 'matrix' key."""
+    if isinstance(value, dict):
+        return "matrix" in value or any(has_matrix(v) for v in value.values())
+    if isinstance(value, list):
+        return any(has_matrix(v) for v in value)
+    return False
+
+
+def expand_matrix(value: Any, attr: Optional[str] = None) -> Iterator[Any]:
+    """
+    Yield copies of value, one for each combination of its nested matrices.
+
+    Each item of a dictionary's 'matrix' list is merged over the other
+    keys, where every key may hold matrices of its own.  Several matrices
+    expand to their cartesian product, generated one combination at a
+    time.  A value without any matrix is yielded as-is, not copied.
+    """
+    if not has_matrix(value):
+        yield value
+        return
+    if isinstance(value, list):
+        for combo in product(*(tuple(expand_matrix(v, attr)) for v in value)):
+            yield list(combo)
+        return
+    keys = [k for k in value if k != "matrix"]
+    items = [dict()]
+    if "matrix" in value:
+        if not isinstance(value["matrix"], list):
+            err(f"Unsupported non-list 'matrix' key encountered in"
+                f" '{attr}' attribute of '{CirrusCfg._working}' task")
+        items = chain.from_iterable(expand_matrix(item, attr) for item in value["matrix"])
+        items = tuple(items)
+    for *combo, item in product(*(tuple(expand_matrix(value[k], k)) for k in keys), items):
+        out = dict(zip(keys, combo))
+        out.update(item)
+        yield out
+
+
+class Task(MappingABC):
+    """
+    Read-only mapping of a rendered task's attributes.
+
+    Only the task's own env. vars. are stored, the global env. is shared
+    by reference between all tasks, rather than copied into each.
+    """
+
+    __slots__ = ("alias", "env", "inst_type", "inst_image", "global_env", "depends_on")
+
+    # Attributes presented as mapping keys, when set.
+    _keys = ("alias", "env", "inst_type", "inst_image")
+
+    def __init__(self, alias: str, global_env: Optional[Mapping[str, str]] = None) -> None:
+        """Create a new task with alias, referencing global_env."""
+        self.alias = intern(alias)
+        self.env = dict()
+        self.global_env = global_env if global_env is not None else dict()
+        # Aliases or names of tasks this one depends on, as written in the config.
+        self.depends_on = ()
+
+    def __getitem__(self, key: str) -> Any:
+        """Return task attribute named key."""
+        if key not in self._keys:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        """Set task attribute named key."""
+        if key not in self._keys:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over names of set attributes."""
+        return (key for key in self._keys if hasattr(self, key))
+
+    def __len__(self) -> int:
+        """Return the number of set attributes."""
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        """Represent the same as a dictionary of set attributes."""
+        return repr(dict(self))
+
+    @property
+    def full_env(self) -> Mapping[str, str]:
+        """Return a view of the task's env. vars. overriding global env. vars."""
+        return ChainMap(self.env, self.global_env)
+
+
 class CirrusCfg:
     """Represent a fully realized list of .cirrus.yml tasks."""
 
@@ -50,11 +201,32 @@ class CirrusCfg:
     global_type = None
     global_image = None
 
+    # Dictionary of rendered Task instances by name, and the sorted names.
+    tasks = None
+    names = None
+
+    # Dictionary of task name to names of tasks it depends on
+    deps = None
+
+    # Inverted indexes to sorted names of tasks, by inst. image, inst. type,
+    # and (key, value) of env. vars., see find_tasks().
+    by_image = None
+    by_type = None
+    by_env = None
+
+    # Sorted keys of by_image, for prefix searches
+    images = None
+
     # Tracks task-parsing status, internal-only, do not use.
     _working = None
 
-    def __init__(self, config: Mapping[str, Any]) -> None:
-        """Create a new instance, given a parsed .cirrus.yml config object."""
+    def __init__(self, config: Mapping[str, Any], lazy: bool = False) -> None:
+        """
+        Create a new instance, given a parsed .cirrus.yml config object.
+
+        When lazy, tasks aren't rendered, leaving tasks, names, deps and
+        indexes unset, for rendering one at a time by iter_tasks().
+        """
         if not isinstance(config, dict):
             whatsit = config.__class__
             raise TypeError(f"Expected 'config' argument to be a dictionary, not a {whatsit}")
@@ -64,11 +236,77 @@ class CirrusCfg:
         dbg(f"Rendered globals: {self.global_env}")
         self.global_type, self.global_image = self.get_type_image(config)
         dbg(f"Using global type '{self.global_type}' and image '{self.global_image}'")
+        if lazy:
+            return
         self.tasks = self.render_tasks(config)
         dbg(f"Processed {len(self.tasks)} tasks")
         self.names = list(self.tasks.keys())
         self.names.sort()
         self.names = tuple(self.names)  # help notice attempts to modify
+        self.deps = self.resolve_deps()
+        self.build_indexes()
+
+    def build_indexes(self) -> None:
+        """Map inst. images, types and env. (key, value) pairs to task names."""
+        by_image = dict()
+        by_type = dict()
+        by_env = dict()
+        for name in self.names:
+            task = self.tasks[name]
+            if "inst_image" in task:
+                by_image.setdefault(task["inst_image"], []).append(name)
+            if "inst_type" in task:
+                by_type.setdefault(task["inst_type"], []).append(name)
+            for item in task.env.items():
+                by_env.setdefault(item, []).append(name)
+        # Names were added in sorted order, tuples help notice attempts to modify.
+        self.by_image = {k: tuple(v) for k, v in by_image.items()}
+        self.by_type = {k: tuple(v) for k, v in by_type.items()}
+        self.by_env = {k: tuple(v) for k, v in by_env.items()}
+        # Global env. vars. apply to every task not setting its own value.
+        overridden = {key for key, _ in by_env}
+        for item in self.global_env.items():
+            if item[0] not in overridden:
+                self.by_env[item] = self.names  # Shared, rather than a copy per var.
+                continue
+            names = [name for name in self.names if item[0] not in self.tasks[name].env]
+            self.by_env[item] = tuple(sorted(self.by_env.get(item, ()) + tuple(names)))
+        self.images = tuple(sorted(self.by_image))
+
+    def find_tasks(self, mode: str, value: str, match: str = MATCHES[0]) -> tuple:
+        """
+        Return sorted names of tasks using an inst. image, type, or env. value.
+
+        The 'image' mode matches value against image names, as given by
+        match ('exact', 'prefix' or 'regex' search).  The 'type' mode
+        matches value exactly, and 'env' mode the value of a KEY=VALUE.
+        """
+        if mode == "type":
+            return self.by_type.get(value, ())
+        if mode == "env":
+            key, sep, env_value = value.partition("=")
+            if not sep:
+                raise ValueError(f"Expected KEY=VALUE, not '{value}'")
+            return self.by_env.get((key, env_value), ())
+        if mode != "image":
+            raise ValueError(f"Unknown find mode '{mode}'")
+        if match == "exact":
+            return self.by_image.get(value, ())
+        if match == "prefix":
+            first = bisect.bisect_left(self.images, value)
+            images = []
+            for image in self.images[first:]:
+                if not image.startswith(value):
+                    break
+                images.append(image)
+        elif match == "regex":
+            image_rx = re.compile(value)
+            images = [image for image in self.images if image_rx.search(image)]
+        else:
+            raise ValueError(f"Unknown match '{match}'")
+        if len(images) == 1:
+            return self.by_image[images[0]]
+        return tuple(sorted(chain.from_iterable(self.by_image[image] for image in images)))
 
     def render_env(self, env: Mapping[str, str]) -> Mapping[str, str]:
         """
@@ -87,7 +325,8 @@ class CirrusCfg:
         out = self.format_env(env, self.global_env)
         for _ in range(9):
             out = self.format_env(out, self.global_env)
-        return out
+        # Many tasks render identical keys and values, only keep one copy of each.
+        return {intern(k): intern(v) for k, v in out.items()}
 
     @staticmethod
     def format_env(env, global_env: Mapping[str, str]) -> Mapping[str, str]:
@@ -109,52 +348,64 @@ class CirrusCfg:
             _ = def_fmt.dollarcurly_env_var.sub(rep, str(v))
             def_fmt[k] = def_fmt.dollar_env_var.sub(rep, _)
         out = dict()
-        for k, v in def_fmt.items():
-            if k in env:  # Don't unnecessarily duplicate globals
-                if k == "PATH":
-                    out[k] = str(v)
-                    continue
-                try:
-                    out[k] = str(v).format_map(def_fmt)
-                except ValueError as xcpt:
-                    if k == 'matrix':
-                        err(f"Unsupported '{k}' key encountered in"
-                            f" 'env' attribute of '{CirrusCfg._working}' task")
-                    raise xcpt
+        for k in env:  # Don't unnecessarily duplicate globals
+            if k not in def_fmt:  # i.e. ENCRYPTED
+                continue
+            v = def_fmt[k]
+            if k == "PATH":
+                out[k] = str(v)
+                continue
+            try:
+                out[k] = str(v).format_map(def_fmt)
+            except ValueError as xcpt:
+                if k == 'matrix':
+                    err(f"Unsupported '{k}' key encountered in"
+                        f" 'env' attribute of '{CirrusCfg._working}' task")
+                raise xcpt
         return out
 
     def render_tasks(self, tasks: Mapping[str, Any]) -> Mapping[str, Any]:
         """Return new tasks dict with envs rendered and matrices unrolled."""
-        result = dict()
+        # Assume Cirrus-CI accepted this config., don't check name clashes
+        return dict(self.iter_tasks(tasks))
+
+    def iter_tasks(self, tasks: Mapping[str, Any]) -> Iterator[tuple]:
+        """Yield (name, Task) of tasks as each is rendered, unrolling matrices lazily."""
         for k, v in tasks.items():
             if not k.endswith("_task"):
                 continue
             # Cirrus-CI uses this defaulting priority order
             alias = v.get("alias", k.replace("_task", ""))
             name = v.get("name", alias)
-            if "matrix" in v:
-                dbg(f"Processing matrix '{alias}'")
-                CirrusCfg._working = alias
-                # Assume Cirrus-CI accepted this config., don't check name clashes
-                result.update(self.unroll_matrix(name, alias, v))
+            CirrusCfg._working = name
+            # Matrices nested in attributes (e.g. 'env') multiply the task-level matrix.
+            body = {key: value for key, value in v.items() if key != "matrix"}
+            for variant in expand_matrix(body, k):
+                if variant is not body and "name" not in v and "matrix" not in v:
+                    # See unroll_matrix(), which checks each matrix item has a name
+                    raise ValueError(f"Expecting 'name' attribute in '{k}'"
+                                     f" with nested matrix: {v}")
+                if "matrix" in v:
+                    dbg(f"Processing matrix '{alias}'")
+                    CirrusCfg._working = alias
+                    yield from self.unroll_matrix(name, alias, dict(variant, matrix=v["matrix"]))
+                else:
+                    dbg(f"Processing task '{name}'")
+                    CirrusCfg._working = name
+                    task = Task(alias, self.global_env)
+                    task["env"] = self.render_env(variant.get("env", dict()))
+                    task.depends_on = self.get_depends_on(variant)
+                    task_name = self.render_value(name, task["env"])
+                    _ = self.get_type_image(variant, self.global_type, self.global_image)
+                    self.init_task_type_image(task, *_)
+                    yield task_name, task
                 CirrusCfg._working = 'global'
-            else:
-                dbg(f"Processing task '{name}'")
-                CirrusCfg._working = name
-                task = dict(alias=alias)
-                task["env"] = self.render_env(v.get("env", dict()))
-                task_name = self.render_value(name, task["env"])
-                _ = self.get_type_image(v, self.global_type, self.global_image)
-                self.init_task_type_image(task, *_)
-                result[task_name] = task
-                CirrusCfg._working = 'global'
-        return result
 
     def unroll_matrix(self, name_default: str, alias_default: str,
-                      task: Mapping[str, Any]) -> Mapping[str, Any]:
-        """Produce copies of task with attributes replaced from matrix list."""
-        result = dict()
-        for item in task["matrix"]:
+                      task: Mapping[str, Any]) -> Iterator[tuple]:
+        """Yield (name, Task) copies of task, with attributes replaced from matrix list."""
+        items = chain.from_iterable(expand_matrix(item, "matrix") for item in task["matrix"])
+        for item in items:
             if "name" not in task and "name" not in item:
                 # Cirrus-CI goes a step further, attempting to generate a
                 # unique name based on alias + matrix attributes.  This is
@@ -165,14 +416,14 @@ class CirrusCfg:
                                  f" '{alias_default}_task'"
                                  f" or matrix definition: {item}"
                                  f" for task definition: {task}")
-            # default values for the rendered task - not mutable, needs a copy.
-            matrix_task = dict(alias=alias_default, env=task.get("env", dict()).copy())
+            matrix_task = Task(alias_default, self.global_env)
             matrix_name = item.get("name", name_default)
             CirrusCfg._working = matrix_name
 
-            # matrix item env. overwrites task env.
-            matrix_task["env"].update(item.get("env", dict()))
-            matrix_task["env"] = self.render_env(matrix_task["env"])
+            # matrix item env. overwrites task env., a view avoids copying either.
+            matrix_env = ChainMap(item.get("env", dict()), task.get("env", dict()))
+            matrix_task["env"] = self.render_env(matrix_env)
+            matrix_task.depends_on = self.get_depends_on(item, self.get_depends_on(task))
             matrix_name = self.render_value(matrix_name, matrix_task["env"])
             dbg(f"    Unrolling matrix for '{matrix_name}'")
             CirrusCfg._working = matrix_name
@@ -181,14 +432,127 @@ class CirrusCfg:
             _ = self.get_type_image(item, self.global_type, self.global_image)
             matrix_type, matrix_image = self.get_type_image(task, *_)
             self.init_task_type_image(matrix_task, matrix_type, matrix_image)
-            result[matrix_name] = matrix_task
-        return result
+            yield matrix_name, matrix_task
+
+    @staticmethod
+    def get_depends_on(item: dict, default: tuple = ()) -> tuple:
+        """Given Cirrus-CI task or matrix item dict., return its depends_on references."""
+        depends_on = item.get("depends_on", default)
+        if isinstance(depends_on, str):
+            return (intern(depends_on),)
+        return tuple(intern(ref) for ref in depends_on)
+
+    def resolve_deps(self) -> Mapping[str, tuple]:
+        """
+        Return dict of task name to the names of tasks it depends on.
+
+        Cirrus-CI matches depends_on references against both task aliases
+        and names.  An alias shared by all tasks unrolled from a matrix
+        resolves to every one of them.
+        """
+        by_ref = dict()
+        for name in self.names:
+            by_ref.setdefault(self.tasks[name]["alias"], []).append(name)
+            if name != self.tasks[name]["alias"]:
+                by_ref.setdefault(name, []).append(name)
+        deps = dict()
+        for name in self.names:
+            task_deps = []
+            for ref in self.tasks[name].depends_on:
+                if ref not in by_ref:
+                    dbg(f"Ignoring unknown depends_on '{ref}' of task '{name}'")
+                    continue
+                task_deps.extend(dep for dep in by_ref[ref]
+                                 if dep != name and dep not in task_deps)
+            deps[name] = tuple(task_deps)
+        return deps
+
+    def critical_path(self, durations: Optional[Mapping[str, float]] = None) -> tuple:
+        """
+        Return the critical path and maximum parallel width of the task graph.
+
+        Tasks are weighted by durations, keyed by task name or alias.  When
+        not given, every task weighs 1, and the path length counts tasks.
+        Tasks missing from durations weigh the mean of those found.  The
+        result is a tuple of: list of (name, duration) along the longest
+        chain of dependencies, the chain's total duration, and the peak
+        number of tasks running at once when each starts as soon as all
+        its dependencies finish.
+        """
+        weights = self.task_weights(durations)
+        start = dict()
+        finish = dict()
+        via = dict()  # Dependency finishing last, delaying the task's start
+        for name in self.topo_order():
+            start[name] = 0
+            via[name] = None
+            for dep in self.deps[name]:
+                if finish[dep] > start[name]:
+                    start[name], via[name] = finish[dep], dep
+            finish[name] = start[name] + weights[name]
+
+        path = []
+        name = max(self.names, key=finish.get)
+        length = finish[name]
+        while name is not None:
+            path.append((name, weights[name]))
+            name = via[name]
+        path.reverse()
+
+        # Sweep start/finish events, finishes sort before starts at the same time.
+        events = sorted([(start[name], 1) for name in self.names if weights[name]]
+                        + [(finish[name], -1) for name in self.names if weights[name]])
+        width = running = 0
+        for _, change in events:
+            running += change
+            width = max(width, running)
+        return path, length, width
+
+    def task_weights(self, durations: Optional[Mapping[str, float]]) -> Mapping[str, float]:
+        """Return dict of task name to its duration, see critical_path()."""
+        if not durations:
+            return {name: 1 for name in self.names}
+        weights = dict()
+        for name in self.names:
+            if name in durations:
+                weights[name] = durations[name]
+            elif self.tasks[name]["alias"] in durations:
+                weights[name] = durations[self.tasks[name]["alias"]]
+        if not weights:
+            raise ValueError("No durations match any task name or alias")
+        mean = sum(weights.values()) / len(weights)
+        for name in self.names:
+            if name not in weights:
+                dbg(f"No duration for task '{name}', assuming mean {mean:g}")
+                weights[name] = mean
+        return weights
+
+    def topo_order(self) -> list:
+        """Return task names ordered so every task follows all of its dependencies."""
+        pending = {name: len(self.deps[name]) for name in self.names}
+        dependents = {name: [] for name in self.names}
+        for name in self.names:
+            for dep in self.deps[name]:
+                dependents[dep].append(name)
+        ready = [name for name in self.names if not pending[name]]
+        order = []
+        while ready:
+            name = ready.pop()
+            order.append(name)
+            for dependent in dependents[name]:
+                pending[dependent] -= 1
+                if not pending[dependent]:
+                    ready.append(dependent)
+        if len(order) != len(self.names):
+            cycle = sorted(name for name in self.names if pending[name])
+            raise ValueError(f"Dependency cycle among tasks: {cycle}")
+        return order
 
     def render_value(self, value: str, env: Mapping[str, str]) -> str:
         """Given a string value and task env dict, safely render references."""
         tmp_env = env.copy()  # don't mess up the original
         tmp_env["__value__"] = value
-        return self.format_env(tmp_env, self.global_env)["__value__"]
+        return intern(self.format_env(tmp_env, self.global_env)["__value__"])
 
     def get_type_image(self, item: dict,
                        default_type: str = None,
@@ -230,6 +594,193 @@ class CirrusCfg:
         dbg(f"    Using type '{task_type}' and image '{inst_image}'")
 
 
+def render_query(ccfg: CirrusCfg, mode: str, task_name: Optional[str] = None,
+                 value: Optional[str] = None, match: str = MATCHES[0],
+                 null: bool = False) -> str:
+    """
+    Return the output text of a 'list', 'envs', 'inst', or CirrusCfg.find_tasks() query.
+
+    When null, lines end with a NUL rather than a newline, and 'envs'
+    values aren't quoted, like the output of 'env -0'.
+    """
+    end = "\0" if null else "\n"
+    if not len(ccfg.names):
+        raise ValueError("No Cirrus-CI tasks found")
+    if mode == "list":
+        return "".join(f"{name}{end}" for name in ccfg.names)
+    if mode in ("image", "type", "env"):
+        return "".join(f"{name}{end}" for name in ccfg.find_tasks(mode, value, match))
+    if task_name not in ccfg.names:
+        raise KeyError(f"Unknown task name '{task_name}'")
+    task = ccfg.tasks[task_name]
+    if mode == "inst":
+        inst_type = task['inst_type']
+        inst_image = task['inst_image']
+        return f"{inst_type} {inst_image}{end}"
+    if mode == "envs":
+        if null:
+            return "".join(f"{key}={value}\0" for key, value in public_env(task).items())
+        return "".join(f'{key}="{value}"\n' for key, value in public_env(task).items())
+    raise ValueError(f"Unknown query mode '{mode}'")
+
+
+def public_env(task: Task) -> Mapping[str, str]:
+    """Return dict of a task's global and own env. vars. sorted by name, less private ones."""
+    env = task.full_env
+    keys = list(env.keys())
+    keys.sort()
+    # Assume names starting with '_' are private to Cirrus-CI
+    return {key: env[key] for key in keys if not key.startswith("_")}
+
+
+def iter_scan_paths(lines: Iterator[str]) -> Iterator[str]:
+    """
+    Yield config. file paths from paths, globs or directories, one per line.
+
+    Globs may use '**' to match any number of subdirectories.  Directories
+    are searched recursively for CFG_FILENAME files.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if os.path.isdir(line):
+            line = os.path.join(line, "**", CFG_FILENAME)
+        elif not any(char in line for char in "*?["):
+            yield line  # Let scan_file() report if it's missing
+            continue
+        yield from sorted(glob.iglob(line, recursive=True))
+
+
+def scan_file(filepath: str) -> tuple:
+    """
+    Return JSON Lines text of every task in a config. file, and if it succeeded.
+
+    Each line is an object with the config's "repo" directory path,
+    task "name", "inst_type", "inst_image" and (--envs) "env".  On
+    failure, a single line with "repo" and "error" is returned instead.
+    """
+    repo = os.path.dirname(os.path.abspath(filepath))
+    try:
+        with open(filepath) as cfg_file:
+            ccfg = CirrusCfg(load_yaml(cfg_file))
+        if not len(ccfg.names):
+            raise ValueError(f"No Cirrus-CI tasks found in '{filepath}'")
+        lines = []
+        for name in ccfg.names:
+            task = ccfg.tasks[name]
+            row = dict(repo=repo, name=name, inst_type=task["inst_type"],
+                       inst_image=task["inst_image"], env=public_env(task))
+            lines.append(json.dumps(row) + "\n")
+        return "".join(lines), True
+    except SystemExit:  # err() already logged why
+        error = f"{filepath}: Rendering failed, see logged error"
+        return json.dumps(dict(repo=repo, error=error)) + "\n", False
+    except Exception as xcpt:
+        error = f"{filepath}: {xcpt.__class__.__name__}: {xcpt}"
+        logging.error(error, extra=dict(loc=""))
+        return json.dumps(dict(repo=repo, error=error)) + "\n", False
+
+
+class CfgCache:
+    """Loaded CirrusCfg instances by config. file path, rebuilt when the file changes."""
+
+    def __init__(self) -> None:
+        """Create a new, empty cache."""
+        # Maps file path to ((mtime, size), sha256 digest, CirrusCfg)
+        self._entries = dict()
+
+    def get(self, filepath: str) -> CirrusCfg:
+        """Return CirrusCfg for filepath, only re-rendering when its content changed."""
+        stat = os.stat(filepath)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        entry = self._entries.get(filepath)
+        if entry is not None and entry[0] == stamp:
+            return entry[2]
+        with open(filepath, "rb") as cfg_file:
+            data = cfg_file.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if entry is not None and entry[1] == digest:
+            dbg(f"Content of '{filepath}' unchanged")
+            ccfg = entry[2]
+        else:
+            dbg(f"Loading '{filepath}'")
+            ccfg = CirrusCfg(load_yaml(data))
+        self._entries[filepath] = (stamp, digest, ccfg)
+        return ccfg
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    """Answer a single JSON-line query from a CLI client, see query_daemon()."""
+
+    def handle(self) -> None:
+        """Reply with the query's 'output', or an 'error' for the client to handle itself."""
+        line = self.rfile.readline()
+        if not line.strip():  # e.g. QueryServer only checking for a live daemon
+            return
+        try:
+            request = json.loads(line)
+            ccfg = self.server.cache.get(request["filepath"])
+            reply = dict(output=render_query(ccfg, request["mode"], request.get("name"),
+                                             request.get("value"),
+                                             request.get("match", MATCHES[0]),
+                                             request.get("null", False)))
+        except (Exception, SystemExit) as xcpt:  # err() calls sys.exit()
+            reply = dict(error=f"{xcpt.__class__.__name__}: {xcpt}")
+            dbg(f"Query failed: {reply['error']}")
+        try:
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+        except BrokenPipeError:
+            dbg("Client disconnected before the reply")
+
+
+class QueryServer(socketserver.UnixStreamServer):
+    """Long-lived server answering queries on a Unix socket, from a CfgCache."""
+
+    def __init__(self, socket_path: str) -> None:
+        """Listen on socket_path, replacing any stale socket left behind."""
+        if os.path.lexists(socket_path):
+            if query_daemon(socket_path, None) is not None:
+                err(f"A daemon is already serving on '{socket_path}'")
+            if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                err(f"Refusing to replace '{socket_path}', it is not a socket")
+            os.unlink(socket_path)
+        self.cache = CfgCache()
+        old_umask = os.umask(0o077)  # Only the current user may connect
+        try:
+            super().__init__(socket_path, QueryHandler)
+        finally:
+            os.umask(old_umask)
+
+    def server_close(self) -> None:
+        """Stop listening and remove the socket."""
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+def query_daemon(socket_path: str, request: Optional[Mapping[str, str]]) -> Optional[str]:
+    """Return a --serve daemon's reply output to request, or None if it can't answer."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(DAEMON_TIMEOUT)
+            sock.connect(socket_path)
+            if request is None:  # Only checking for a listening daemon
+                return ""
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            with sock.makefile("rb") as reply_file:
+                reply = json.loads(reply_file.readline())
+    except (OSError, ValueError) as xcpt:
+        dbg(f"No usable daemon at '{socket_path}': {xcpt}")
+        return None
+    if "error" in reply:
+        dbg(f"Daemon could not answer: {reply['error']}")
+        return None
+    return reply["output"]
+
+
 class CLI:
     """Represent command-line-interface runtime state and behaviors."""
 
@@ -256,46 +807,214 @@ class CLI:
         else:
             logger.setLevel(logging.ERROR)
 
-        self.ccfg = CirrusCfg(yaml.safe_load(self.args.filepath))
+        if self.args.serve and not self.args.socket:
+            self.parser.error("--serve requires --socket or $CIRRUS_CI_ENV_SOCKET")
+        if self.args.durations and not self.args.critical_path:
+            self.parser.error("--durations requires --critical-path")
+        if self.args.stream and not self.args.list:
+            self.parser.error("--stream requires --list")
+        if self.args.match != MATCHES[0] and self.args.uses_image is None:
+            self.parser.error("--match requires --uses-image")
+        if self.args.match == "regex":
+            try:
+                re.compile(self.args.uses_image)
+            except re.error as xcpt:
+                self.parser.error(f"Invalid --uses-image regex: {xcpt}")
+        if self.args.sets_env is not None and "=" not in self.args.sets_env:
+            self.parser.error("--sets-env requires a KEY=VALUE argument")
+        if self.args.exec is not None and not self.args.command:
+            self.parser.error("--exec requires a <command> following '--'")
+        if self.args.command and self.args.exec is None:
+            self.parser.error("<command> requires --exec")
+        if self.args.scan and self.args.filepath is not None:
+            self.parser.error("<filepath> is not used with --scan, give paths to --scan")
+        if not self.args.scan and self.args.filepath is None:
+            self.parser.error("the following arguments are required: <filepath>")
+        if self.args.null and (self.args.critical_path or self.args.scan or self.args.serve
+                               or self.args.exec is not None):
+            self.parser.error("--null is not supported by --critical-path, --scan,"
+                              " --serve, or --exec")
+
+    def load(self) -> None:
+        """Parse and render the config file in-process."""
+        self.ccfg = CirrusCfg(load_yaml(self.args.filepath))
         if not len(self.ccfg.names):
             self.parser.print_help()
             err(f"No Cirrus-CI tasks found in '{self.args.filepath.name}'")
 
     def __call__(self) -> None:
         """Execute request command-line actions."""
+        if self.args.serve:
+            self.serve()
+            return
+        if self.args.critical_path:
+            self.show_critical_path()
+            return
+        if self.args.stream:
+            self.stream_list()
+            return
+        if self.args.scan:
+            self.scan()
+            return
+        value = None
+        null = self.args.null
         if self.args.list:
             dbg("Will be listing task names")
-            for task_name in self.ccfg.names:
-                sys.stdout.write(f"{task_name}\n")
+            mode, task_name = "list", None
         elif bool(self.args.inst):
             dbg("Will be showing task inst. type and image")
-            task = self.ccfg.tasks[self.valid_name()]
-            inst_type = task['inst_type']
-            inst_image = task['inst_image']
-            sys.stdout.write(f"{inst_type} {inst_image}\n")
+            mode, task_name = "inst", self.args.inst
         elif bool(self.args.envs):
             dbg("Will be listing task env. vars.")
-            task = self.ccfg.tasks[self.valid_name()]
-            env = self.ccfg.global_env.copy()
-            env.update(task['env'])
-            keys = list(env.keys())
-            keys.sort()
-            for key in keys:
-                if key.startswith("_"):
-                    continue  # Assume private to Cirrus-CI
-                value = env[key]
-                sys.stdout.write(f'{key}="{value}"\n')
+            mode, task_name = "envs", self.args.envs
+        elif self.args.exec is not None:
+            dbg("Will be executing a command with task env. vars.")
+            # Unquoted values are simplest to parse back, see exec().
+            mode, task_name, null = "envs", self.args.exec, True
+        else:
+            dbg("Will be finding tasks by inst. image, type or env. value")
+            mode, task_name, value = "image", None, self.args.uses_image
+            if self.args.uses_type is not None:
+                mode, value = "type", self.args.uses_type
+            elif self.args.sets_env is not None:
+                mode, value = "env", self.args.sets_env
+
+        if self.args.socket:
+            request = dict(filepath=os.path.realpath(self.args.filepath.name),
+                           mode=mode, name=task_name, value=value, match=self.args.match,
+                           null=null)
+            output = query_daemon(self.args.socket, request)
+            if output is not None:
+                self.output(output)
+                return
+            dbg("Falling back to in-process rendering")
+        self.load()
+        if task_name is not None:
+            self.valid_name()
+        self.output(render_query(self.ccfg, mode, task_name, value, self.args.match, null))
+
+    def output(self, output: str) -> None:
+        """Print query output, or exec() the --exec command with it."""
+        if self.args.exec is None:
+            sys.stdout.write(output)
+        else:
+            self.exec(output)
+
+    def exec(self, output: str) -> None:
+        """Replace this process with the --exec command, given NUL-delimited env. vars."""
+        env = dict(os.environ)
+        for line in output.split("\0")[:-1]:
+            # Values pass through as rendered, like the '-0' output, any
+            # remaining references (e.g. $PATH) are left to <command>.
+            key, _, value = line.partition("=")
+            env[key] = value
+        dbg(f"Executing {self.args.command}")
+        try:
+            os.execvpe(self.args.command[0], self.args.command, env)
+        except OSError as xcpt:
+            err(f"Cannot execute '{self.args.command[0]}': {xcpt.strerror}")
+
+    def scan(self) -> None:
+        """Print JSON Lines of tasks from every config. file found by --scan paths."""
+        dbg("Will be scanning config. files")
+        # A '-' path reads more paths from stdin, one per line.
+        paths = chain.from_iterable(sys.stdin if path == "-" else (path,)
+                                    for path in self.args.scan)
+        filepaths = list(iter_scan_paths(paths))
+        failed = 0
+        # Order of results follows filepaths, each is written as soon as it's ready.
+        with ProcessPoolExecutor(max_workers=SCAN_WORKERS) as pool:
+            for output, succeeded in pool.map(scan_file, filepaths):
+                sys.stdout.write(output)
+                sys.stdout.flush()
+                failed += not succeeded
+        if failed:
+            err(f"Failed to scan {failed} of {len(filepaths)} config. files")
+
+    def stream_list(self) -> None:
+        """Print task names as each is rendered, without keeping the rendered tasks."""
+        dbg("Will be streaming task names")
+        config = load_yaml(self.args.filepath)
+        ccfg = CirrusCfg(config, lazy=True)
+        seen = set()  # Matrices may repeat a name, as for --list only show it once.
+        try:
+            for name, _ in ccfg.iter_tasks(config):
+                if name not in seen:
+                    seen.add(name)
+                    sys.stdout.write(f"{name}\0" if self.args.null else f"{name}\n")
+        except BrokenPipeError:
+            # Reader stopped early (e.g. head), don't render the rest.
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return
+        if not seen:
+            self.parser.print_help()
+            err(f"No Cirrus-CI tasks found in '{self.args.filepath.name}'")
+
+    def show_critical_path(self) -> None:
+        """Print the critical path of task dependencies, and the maximum parallel width."""
+        dbg("Will be showing the critical path")
+        self.load()
+        durations = None
+        if self.args.durations:
+            durations = load_durations(self.args.durations)
+        try:
+            path, length, width = self.ccfg.critical_path(durations)
+        except ValueError as xcpt:
+            err(str(xcpt))
+        sys.stdout.write(f"# Critical path: {len(path)} tasks, length {length:g}\n")
+        for name, duration in path:
+            sys.stdout.write(f"{duration:g}\t{name}\n")
+        sys.stdout.write(f"# Maximum parallel width: {width}\n")
+
+    def serve(self) -> None:
+        """Answer client queries on the socket until interrupted."""
+        server = QueryServer(self.args.socket)
+        # Warm the cache with the config. file given on the command-line
+        server.cache.get(os.path.realpath(self.args.filepath.name))
+        self.args.filepath.close()
+        dbg(f"Serving on '{self.args.socket}'")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
 
     def args_parser(self) -> argparse.ArgumentParser:
         """Parse command-line options and arguments."""
-        epilog = "Note: One of --list, --envs, or --inst MUST be specified"
+        epilog = ("Note: One of --list, --envs, --inst, --exec, --uses-image, --uses-type,"
+                  " --sets-env, --critical-path, --scan, or --serve MUST be specified."
+                  " With --exec, <command> and its arguments follow '--' after <filepath>")
         parser = argparse.ArgumentParser(description=__doc__,
                                          epilog=epilog)
-        parser.add_argument('filepath', type=argparse.FileType("rt"),
-                            help="File path to .cirrus.yml",
+        parser.add_argument('filepath', type=argparse.FileType("rt"), nargs='?',
+                            help="File path to .cirrus.yml, required except with --scan",
                             metavar='<filepath>')
+        parser.add_argument('command', nargs='*',
+                            help="Command and arguments to run with --exec",
+                            metavar='<command>')
         parser.add_argument('--debug', action='store_true',
                             help="Enable output of debbuging messages")
+        parser.add_argument('--socket', action='store',
+                            default=os.environ.get("CIRRUS_CI_ENV_SOCKET"),
+                            help=("Unix socket path of a --serve daemon to query, falling"
+                                  " back to in-process rendering when it's not running."
+                                  " Default: $CIRRUS_CI_ENV_SOCKET"),
+                            metavar="<path>")
+        parser.add_argument('--stream', action='store_true',
+                            help=("With --list, print names in config. order as each task is"
+                                  " rendered, rather than sorted after rendering them all"))
+        parser.add_argument('-0', '--null', action='store_true',
+                            help=("End each output line with NUL, not newline, and don't"
+                                  " quote --envs values, like 'env -0'"))
+        parser.add_argument('--match', choices=MATCHES, default=MATCHES[0],
+                            help=("How --uses-image matches image names"
+                                  f" (default: {MATCHES[0]})"))
+        parser.add_argument('--durations', type=argparse.FileType("rt"),
+                            help=("With --critical-path, weight tasks by durations from"
+                                  " a JSON object, or CSV rows, of task name/alias and"
+                                  " duration"),
+                            metavar="<filepath>")
         mgroup = parser.add_mutually_exclusive_group(required=True)
         mgroup.add_argument('--list', action='store_true',
                             help="List canonical task names")
@@ -305,12 +1024,39 @@ class CLI:
         mgroup.add_argument('--inst', action='store',
                             help="List instance type and image for task <name>",
                             metavar="<name>")
+        mgroup.add_argument('--exec', action='store',
+                            help=("Execute <command> with the env. vars. of task <name>,"
+                                  " in place of this process"),
+                            metavar="<name>")
+        mgroup.add_argument('--uses-image', action='store',
+                            help="List names of tasks using instance image <image>",
+                            metavar="<image>")
+        mgroup.add_argument('--uses-type', action='store',
+                            help="List names of tasks using instance type <type>",
+                            metavar="<type>")
+        mgroup.add_argument('--sets-env', action='store',
+                            help="List names of tasks with env. var. KEY set to VALUE",
+                            metavar="<KEY=VALUE>")
+        mgroup.add_argument('--critical-path', action='store_true',
+                            help=("Show the longest chain of task dependencies, and the"
+                                  " most tasks able to run at once"))
+        mgroup.add_argument('--scan', nargs='+',
+                            help=("Print JSON Lines of every task's details from config."
+                                  " file paths, globs or directories (searched for"
+                                  f" {CFG_FILENAME}).  A '-' <path> reads more of them"
+                                  " from stdin, one per line"),
+                            metavar="<path>")
+        mgroup.add_argument('--serve', action='store_true',
+                            help=("Run as a daemon answering other invocations' queries"
+                                  " on --socket, keeping configs. in memory"))
         return parser
 
     def valid_name(self) -> str:
         """Print helpful error message when task name is invalid, or return it."""
         if self.args.envs is not None:
             task_name = self.args.envs
+        elif self.args.exec is not None:
+            task_name = self.args.exec
         else:
             task_name = self.args.inst
         file_name = self.args.filepath.name
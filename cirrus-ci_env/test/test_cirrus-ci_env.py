@@ -2,13 +2,16 @@
 
 """Verify cirrus-ci_env.py functions as expected."""
 
-import contextlib
 import importlib.util
+import json
 import os
+import shutil
 import sys
+import threading
 import unittest
 import unittest.mock as mock
 from io import StringIO
+from tempfile import TemporaryDirectory
 
 import yaml
 
@@ -204,7 +207,7 @@ class TestRenderTasks(TestBase):
         self.assertNotIn('test_task', result)
         for task_name in ('test_matrix1', 'test_matrix2'):
             self.assertIn(task_name, result)
-            self.assertDictEqual(expected[task_name], result[task_name])
+            self.assertDictEqual(expected[task_name], dict(result[task_name]))
         self.assertDictEqual(result, expected)
 
     def test_noenv_matrix(self):
@@ -252,16 +255,70 @@ class TestRenderTasks(TestBase):
         result = self.CCfg(config).tasks
         self.assertDictEqual(result, expected)
 
+    def test_shared_env(self):
+        """Verify matrix tasks share global env. and interned values, not copies."""
+        matrix1 = dict(name="test_matrix1", env=dict(item="${foo}bar"))
+        matrix2 = dict(name="test_matrix2", env=dict(item="foo$baz"))
+        task = dict(env=dict(something="un" + "touched"), matrix=[matrix1, matrix2])
+        config = dict(env=self.global_env, test_task=task)
+        ccfg = self.CCfg(config)
+        task1 = ccfg.tasks["test_matrix1"]
+        task2 = ccfg.tasks["test_matrix2"]
+        self.assertIs(task1.global_env, task2.global_env)
+        self.assertIs(task1["env"]["something"], task2["env"]["something"])
+        self.assertEqual(task1.full_env["foo"], "foo")
+        self.assertEqual(task1.full_env["item"], "foobar")
+        self.assertNotIn("foo", task1)
+        self.assertRaises(KeyError, task1.__getitem__, "global_env")
+        self.assertFalse(hasattr(task1, "__dict__"))
+
+    def test_env_matrix(self):
+        """Verify an env. matrix list multiplies with the task matrix."""
+        env = dict(something="untouched", matrix=[dict(item="$foo"), dict(item="$bar")])
+        task = dict(name="test $item $other", env=env,
+                    matrix=[dict(env=dict(other="1")), dict(env=dict(other="2"))])
+        config = dict(env=self.global_env, test_task=task)
+        result = self.CCfg(config).tasks
+        self.assertEqual(list(result), ["test foo 1", "test foo 2", "test bar 1", "test bar 2"])
+        self.assertDictEqual(dict(result["test bar 2"]),
+                             dict(alias="test",
+                                  env=dict(something="untouched", item="bar", other="2")))
+
+    def test_expand_matrix(self):
+        """Verify nested matrices expand lazily, to their cartesian product."""
+        value = dict(a=dict(matrix=[dict(b=1), dict(b=2)], c=3),
+                     d=[dict(matrix=[dict(e=4), dict(e=5), dict(e=6)])])
+        combos = self.cci_env.expand_matrix(value)
+        self.assertEqual(next(combos), dict(a=dict(c=3, b=1), d=[dict(e=4)]))
+        self.assertEqual(len(list(combos)), 5)
+        plain = dict(a=[dict(b=1)])
+        self.assertIs(next(self.cci_env.expand_matrix(plain)), plain)
+
+    def test_lazy(self):
+        """Verify lazy instances render tasks only on iteration."""
+        task = dict(name="test $item", env=dict(matrix=[dict(item="1"), dict(item="2")]))
+        config = dict(env=self.global_env, test_task=task)
+        ccfg = self.CCfg(config, lazy=True)
+        self.assertIsNone(ccfg.tasks)
+        self.assertEqual([name for name, _ in ccfg.iter_tasks(config)], ["test 1", "test 2"])
+        task["matrix"] = [dict(name="x $item"), dict(name="y $item")]
+        self.assertEqual(self.CCfg(config).names, ("x 1", "x 2", "y 1", "y 2"))
+        del task["name"], task["matrix"]
+        with self.assertRaisesRegex(ValueError, "Expecting 'name' attribute"):
+            self.CCfg(config)
+
     def test_bad_env_matrix(self):
         """Verify old-style 'matrix' key of 'env' attr. throws helpful error."""
         env = dict(foo="bar", matrix=dict(will="error"))
         task = dict(env=env)
         config = dict(env=self.global_env, test_task=task)
-        err = StringIO()
-        with contextlib.suppress(SystemExit), mock.patch.object(self.cci_env,
-                                                                'err', err.write):
-            self.assertRaises(ValueError, self.CCfg, config)
-        self.assertRegex(err.getvalue(), ".+'matrix'.+'env'.+'test'.+")
+        with self.assertLogs(level="ERROR") as logs:
+            self.assertRaises(SystemExit, self.CCfg, config)
+        self.assertRegex(logs.output[0], ".+'matrix'.+'env'.+'test'.+")
+        config = dict(env=dict(matrix=[dict(will="error")]), test_task=dict())
+        with self.assertLogs(level="ERROR") as logs:
+            self.assertRaises(SystemExit, self.CCfg, config)
+        self.assertRegex(logs.output[0], ".+'matrix'.+'env'.+'global'.+")
 
 
 class TestCirrusCfg(TestBase):
@@ -282,6 +339,38 @@ class TestCirrusCfg(TestBase):
         self.assertSetEqual(set(actual_cfg.tasks.keys()),
                             set(expected_cirrus["tasks"].keys()))
 
+    def test_find_tasks(self):
+        """Verify inverted index lookups match scanning every task."""
+        actual_cfg = self.CirrusCfg(self.actual_cirrus)
+        for name in actual_cfg.names:
+            task = actual_cfg.tasks[name]
+            for key, value in task.full_env.items():
+                with self.subTest(key=key, value=value):
+                    self.assertEqual(actual_cfg.find_tasks("env", f"{key}={value}"),
+                                     tuple(other for other in actual_cfg.names
+                                           if actual_cfg.tasks[other].full_env.get(key) == value))
+            self.assertIn(name, actual_cfg.find_tasks("image", task["inst_image"]))
+            self.assertIn(name, actual_cfg.find_tasks("type", task["inst_type"]))
+        self.assertEqual(actual_cfg.find_tasks("type", "osx"), ("MacOS Cross", "OSX Cross"))
+        self.assertEqual(len(actual_cfg.find_tasks("image", "ubuntu-", "prefix")), 6)
+        self.assertEqual(len(actual_cfg.find_tasks("image", "ubuntu-c65", "regex")), 12)
+        self.assertEqual(actual_cfg.find_tasks("image", "foo"), ())
+        self.assertEqual(actual_cfg.find_tasks("env", "FOO=bar"), ())
+        self.assertRaises(ValueError, actual_cfg.find_tasks, "env", "FOO")
+
+    def test_null_output(self):
+        """Verify NUL-delimited query output parses back to the unquoted values."""
+        self.actual_cirrus["env"]["QUOTED"] = 'say "hi"\nbye'
+        actual_cfg = self.CirrusCfg(self.actual_cirrus)
+        name = "Ext. services"
+        output = self.cci_env.render_query(actual_cfg, "envs", name, null=True)
+        self.assertTrue(output.endswith("\0"))
+        actual_env = dict(line.partition("=")[::2] for line in output.split("\0")[:-1])
+        self.assertDictEqual(actual_env, self.cci_env.public_env(actual_cfg.tasks[name]))
+        self.assertEqual(actual_env["QUOTED"], 'say "hi"\nbye')
+        self.assertEqual(self.cci_env.render_query(actual_cfg, "list", null=True),
+                         "".join(f"{name}\0" for name in actual_cfg.names))
+
     def test_complex_type_image(self):
         """Verify that CirrusCfg initializes with expected image types and values."""
         with open(os.path.join(TEST_DIRPATH, "expected_ti.yml")) as expected:
@@ -294,5 +383,201 @@ class TestCirrusCfg(TestBase):
         self.assertDictEqual(actual_ti, expected_ti)
 
 
+class TestDependencies(TestBase):
+    """Fixture to verify the task dependency graph and its critical path."""
+
+    def setUp(self):
+        """Initialize before every test."""
+        super().setUp()
+        self.config = dict(
+            container=dict(image="foo"),
+            a_task=dict(),
+            b_task=dict(depends_on=["a"],
+                        matrix=[dict(name="b1"), dict(name="b2")]),
+            c_task=dict(name="see", depends_on=["b"]),
+            d_task=dict(),
+            e_task=dict(depends_on=["see", "unknown"]))
+
+    def test_fan_out(self):
+        """Verify depends_on references resolve to every task of an alias."""
+        with open(os.path.join(TEST_DIRPATH, "actual_cirrus.yml")) as actual:
+            actual_cfg = self.cci_env.CirrusCfg(yaml.safe_load(actual))
+        self.assertEqual(actual_cfg.deps["Validate fedora-33 Build"],
+                         ("Ext. services", "Check Automation", "Build for fedora-33",
+                          "Build for ubuntu-2004", "Build for ubuntu-2010"))
+        ccfg = self.cci_env.CirrusCfg(self.config)
+        self.assertDictEqual(ccfg.deps, dict(a=(), b1=("a",), b2=("a",),
+                                             see=("b1", "b2"), d=(), e=("see",)))
+        self.assertNotIn("depends_on", ccfg.tasks["e"])
+
+    def test_critical_path(self):
+        """Verify the unweighted critical path counts tasks."""
+        ccfg = self.cci_env.CirrusCfg(self.config)
+        path, length, width = ccfg.critical_path()
+        self.assertEqual(path, [("a", 1), ("b1", 1), ("see", 1), ("e", 1)])
+        self.assertEqual(length, 4)
+        self.assertEqual(width, 2)
+
+    def test_weighted_critical_path(self):
+        """Verify durations by alias or name, defaulting to their mean."""
+        ccfg = self.cci_env.CirrusCfg(self.config)
+        durations = dict(a=1, b=2, b2=9, see=3, e=1)
+        path, length, width = ccfg.critical_path(durations)
+        self.assertEqual(path, [("a", 1), ("b2", 9), ("see", 3), ("e", 1)])
+        self.assertEqual(length, 14)
+        self.assertEqual(width, 3)  # b1, b2 and d, lasting the mean of 3.2
+        with self.assertRaisesRegex(ValueError, "No durations match"):
+            ccfg.critical_path(dict(unknown=1))
+
+    def test_cycle(self):
+        """Verify a dependency cycle is reported."""
+        self.config["a_task"]["depends_on"] = "e"
+        ccfg = self.cci_env.CirrusCfg(self.config)
+        with self.assertRaisesRegex(ValueError, "cycle among tasks: .'a', 'b1'"):
+            ccfg.critical_path()
+
+    def test_load_durations(self):
+        """Verify durations load from CSV with a header, or JSON."""
+        csv_file = StringIO("task,seconds\na,1.5\nsee, 3\n\n")
+        csv_file.name = "durations.csv"
+        self.assertDictEqual(self.cci_env.load_durations(csv_file), dict(a=1.5, see=3))
+        json_file = StringIO('{"a": 1.5, "see": 3}')
+        json_file.name = "durations.json"
+        self.assertDictEqual(self.cci_env.load_durations(json_file), dict(a=1.5, see=3))
+
+
+class TestScan(TestBase):
+    """Fixture to verify scanning many config. files."""
+
+    def setUp(self):
+        """Initialize before every test."""
+        super().setUp()
+        self.tmp = TemporaryDirectory(prefix="test_cci_env_")
+        self.addCleanup(self.tmp.cleanup)
+        for repo in ("good", "bad", os.path.join("nested", "deeper")):
+            os.makedirs(os.path.join(self.tmp.name, repo))
+        self.good = os.path.join(self.tmp.name, "good", ".cirrus.yml")
+        shutil.copy(os.path.join(TEST_DIRPATH, "actual_cirrus.yml"), self.good)
+        self.nested = os.path.join(self.tmp.name, "nested", "deeper", ".cirrus.yml")
+        with open(self.nested, "w") as nested:
+            nested.write("x_task:\n  container: {image: 'foo:$A'}\n  env: {A: bar, _B: baz}\n")
+        self.bad = os.path.join(self.tmp.name, "bad", ".cirrus.yml")
+        with open(self.bad, "w") as bad:
+            bad.write("x_task: [\n")
+
+    def test_scan_paths(self):
+        """Verify directories and globs expand to config. file paths."""
+        lines = [self.tmp.name + "\n", "\n", os.path.join(self.tmp.name, "*", ".cirrus.yml"),
+                 "/path/to/not/existing.yml"]
+        self.assertEqual(list(self.cci_env.iter_scan_paths(lines)),
+                         [self.bad, self.good, self.nested, self.bad, self.good,
+                          "/path/to/not/existing.yml"])
+
+    def test_scan_file(self):
+        """Verify JSON Lines rows of each task, or of a per-file error."""
+        output, succeeded = self.cci_env.scan_file(self.nested)
+        self.assertTrue(succeeded)
+        self.assertEqual(json.loads(output),
+                         dict(repo=os.path.dirname(self.nested), name="x",
+                              inst_type="container", inst_image="foo:bar", env=dict(A="bar")))
+        output, succeeded = self.cci_env.scan_file(self.good)
+        self.assertTrue(succeeded)
+        self.assertEqual(len(output.splitlines()), 47)
+        with self.assertLogs(level="ERROR"):
+            output, succeeded = self.cci_env.scan_file(self.bad)
+        self.assertFalse(succeeded)
+        self.assertEqual(json.loads(output)["repo"], os.path.dirname(self.bad))
+        self.assertIn("ParserError", json.loads(output)["error"])
+
+
+class TestDaemon(TestBase):
+    """Fixture to verify --serve daemon queries and config. caching."""
+
+    def setUp(self):
+        """Initialize before every test."""
+        super().setUp()
+        self.tmpdir = TemporaryDirectory(prefix="test_cci_env_")
+        self.socket_path = os.path.join(self.tmpdir.name, "test.sock")
+        self.cfg_path = os.path.join(self.tmpdir.name, "cirrus.yml")
+        shutil.copy(os.path.join(TEST_DIRPATH, "actual_cirrus.yml"), self.cfg_path)
+        self.server = self.cci_env.QueryServer(self.socket_path)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        """Finalize after every test."""
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def query(self, mode, name=None, value=None, match="exact", null=False):
+        """Return daemon output for a query of self.cfg_path."""
+        request = dict(filepath=self.cfg_path, mode=mode, name=name, value=value, match=match,
+                       null=null)
+        return self.cci_env.query_daemon(self.socket_path, request)
+
+    def test_queries(self):
+        """Verify daemon output matches in-process rendering."""
+        with open(self.cfg_path) as cfg_file:
+            ccfg = self.cci_env.CirrusCfg(yaml.safe_load(cfg_file))
+        for mode, name, value, match in (("list", None, None, "exact"),
+                                         ("inst", "Ext. services", None, "exact"),
+                                         ("envs", "int podman fedora-33 root container",
+                                          None, "exact"),
+                                         ("image", None, "fedora-", "prefix"),
+                                         ("env", None, "DISTRO_NV=ubuntu-2004", "exact")):
+            with self.subTest(mode=mode, name=name):
+                self.assertEqual(self.query(mode, name, value, match),
+                                 self.cci_env.render_query(ccfg, mode, name, value, match))
+                self.assertEqual(self.query(mode, name, value, match, True),
+                                 self.cci_env.render_query(ccfg, mode, name, value, match, True))
+
+    def test_errors(self):
+        """Verify daemon errors result in None, for in-process fallback."""
+        self.assertIsNone(self.query("envs", "foobarbaz"))
+        self.assertIsNone(self.query("bogus"))
+        self.cfg_path = "/path/to/not/existing/file.yml"
+        self.assertIsNone(self.query("list"))
+
+    def test_not_running(self):
+        """Verify None is returned when no daemon is listening."""
+        self.assertIsNone(self.cci_env.query_daemon(self.socket_path + "X", dict()))
+
+    def test_not_a_socket(self):
+        """Verify an existing non-socket file isn't replaced by a daemon socket."""
+        with self.assertLogs(level="ERROR") as logs:
+            self.assertRaises(SystemExit, self.cci_env.QueryServer, self.cfg_path)
+        self.assertRegex(logs.output[0], "not a socket")
+        self.assertTrue(os.path.isfile(self.cfg_path))
+
+    def test_already_serving(self):
+        """Verify a second daemon on a live socket exits, leaving the first answering."""
+        with mock.patch.object(self.server, 'handle_error') as handle_error:
+            with self.assertLogs(level="ERROR") as logs:
+                self.assertRaises(SystemExit, self.cci_env.QueryServer, self.socket_path)
+            self.assertRegex(logs.output[0], "already serving")
+            # Queries are answered in turn, so the liveness check was handled by now.
+            self.assertIn("Ext. services", self.query("list"))
+        handle_error.assert_not_called()
+
+    def test_cache(self):
+        """Verify a config. is only re-rendered when its content changes."""
+        real_cirrus_cfg = self.cci_env.CirrusCfg
+        with mock.patch.object(self.cci_env, 'CirrusCfg',
+                               side_effect=real_cirrus_cfg) as cfg_mock:
+            self.assertIn("Ext. services", self.query("list"))
+            self.query("list")
+            self.assertEqual(cfg_mock.call_count, 1)
+            os.utime(self.cfg_path)  # Same content, new mtime
+            self.query("list")
+            self.assertEqual(cfg_mock.call_count, 1)
+            with open(self.cfg_path, "w") as cfg_file:
+                cfg_file.write("only_task:\n  container:\n    image: foo\n")
+            self.assertEqual(self.query("list"), "only\n")
+            self.assertEqual(cfg_mock.call_count, 2)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -8,15 +8,19 @@ TEST_DIR=$(realpath "$SCRIPT_DIRPATH/../")
 SUBJ_FILEPATH="$TEST_DIR/${SUBJ_FILENAME%.sh}.py"
 
 test_cmd "Verify no options results in help and an error-exit" \
-    2 "cirrus-ci_env.py: error: the following arguments are required:" \
+    2 "cirrus-ci_env.py: error: one of the arguments" \
     $SUBJ_FILEPATH
 
+test_cmd "Verify a mode-option without a filename results in an error-exit" \
+    2 "cirrus-ci_env.py: error: the following arguments are required: <filepath>" \
+    $SUBJ_FILEPATH --list
+
 test_cmd "Verify missing/invalid filename results in help and an error-exit" \
     2 "No such file or directory" \
     $SUBJ_FILEPATH /path/to/not/existing/file.yml \
 
 test_cmd "Verify missing mode-option results in help message and an error-exit" \
-    2 "error: one of the arguments --list --envs --inst is required" \
+    2 "error: one of the arguments --list --envs --inst --exec --uses-image --uses-type --sets-env --critical-path --scan --serve is required" \
     $SUBJ_FILEPATH $SCRIPT_DIRPATH/actual_cirrus.yml
 
 test_cmd "Verify valid-YAML w/o tasks results in help message and an error-exit" \
@@ -35,6 +39,14 @@ echo "$TASK_NAMES" | while read LINE; do
     $SUBJ_FILEPATH --list $CIRRUS
 done
 
+test_cmd "Verify streamed task-listing output includes matrix tasks" \
+    0 "Build for ubuntu-2010" \
+    $SUBJ_FILEPATH --list --stream $CIRRUS
+
+test_cmd "Verify --stream without --list results in an error-exit" \
+    2 "error: --stream requires --list" \
+    $SUBJ_FILEPATH --stream --inst 'Ext. services' $CIRRUS
+
 test_cmd "Verify inherited instance image with env. var. reference is rendered" \
     0 "container quay.io/libpod/fedora_podman:c6524344056676352" \
     $SUBJ_FILEPATH --inst 'Ext. services' $CIRRUS
@@ -47,4 +59,73 @@ test_cmd "Verify VM_IMAGE_NAME env. var renders correctly from test task" \
     0 'VM_IMAGE_NAME="fedora-c6524344056676352"' \
     $SUBJ_FILEPATH --env 'int podman fedora-33 root container' $CIRRUS
 
+test_cmd "Verify --exec runs a command with the task's env. vars." \
+    0 "fedora-33" \
+    $SUBJ_FILEPATH --exec 'int podman fedora-33 root container' $CIRRUS -- printenv DISTRO_NV
+
+test_cmd "Verify --exec passes values through without expanding references" \
+    0 'podman/\$\{CIRRUS_TASK_NAME\}-runner_stats.log' \
+    env CIRRUS_TASK_NAME=expanded \
+    $SUBJ_FILEPATH --exec 'int podman fedora-33 root container' $CIRRUS -- printenv STATS_LOGFILE
+
+test_cmd "Verify --exec without a command results in an error-exit" \
+    2 "error: --exec requires a <command> following '--'" \
+    $SUBJ_FILEPATH --exec 'Ext. services' $CIRRUS
+
+test_cmd "Verify --null ends each task name with NUL" \
+    0 "Ext. services|" \
+    bash -c "$SUBJ_FILEPATH --null --list $CIRRUS | tr '\\0' '|' | grep -o 'Ext. services|'"
+
+test_cmd "Verify tasks are found by instance image prefix" \
+    0 "Build for ubuntu-2010" \
+    $SUBJ_FILEPATH --uses-image ubuntu- --match prefix $CIRRUS
+
+test_cmd "Verify tasks are found by env. var. value" \
+    0 "int podman fedora-33 root container" \
+    $SUBJ_FILEPATH --sets-env DISTRO_NV=fedora-33 $CIRRUS
+
+test_cmd "Verify --match without --uses-image results in an error-exit" \
+    2 "error: --match requires --uses-image" \
+    $SUBJ_FILEPATH --match regex --list $CIRRUS
+
+test_cmd "Verify the critical path runs through the final task" \
+    0 "1 Optional Release Test" \
+    $SUBJ_FILEPATH --critical-path $CIRRUS
+
+test_cmd "Verify --durations without --critical-path results in an error-exit" \
+    2 "error: --durations requires --critical-path" \
+    $SUBJ_FILEPATH --durations $CIRRUS --list $CIRRUS
+
+test_cmd "Verify --scan reports tasks as JSON Lines" \
+    0 '"name": "Ext. services", "inst_type": "container"' \
+    $SUBJ_FILEPATH --scan $CIRRUS
+
+test_cmd "Verify --scan reports a missing file without stopping" \
+    1 'ERROR: Failed to scan 1 of 2 config. files' \
+    $SUBJ_FILEPATH --scan /path/to/not/existing.yml $CIRRUS
+
+SCAN_DIR=$(mktemp -d -p '' "tmp_scan_XXXXXXXX")
+mkdir -p $SCAN_DIR/repo
+cp $CIRRUS $SCAN_DIR/repo/.cirrus.yml
+test_cmd "Verify --scan searches directories for .cirrus.yml" \
+    0 '"name": "Ext. services", "inst_type": "container"' \
+    $SUBJ_FILEPATH --scan $SCAN_DIR
+rm -rf $SCAN_DIR
+
+test_cmd "Verify --scan reads paths from stdin given '-'" \
+    0 '"name": "Ext. services", "inst_type": "container"' \
+    bash -c "echo $CIRRUS | $SUBJ_FILEPATH --scan -"
+
+test_cmd "Verify --scan rejects a <filepath>" \
+    2 "error: <filepath> is not used with --scan" \
+    $SUBJ_FILEPATH $CIRRUS --scan $CIRRUS
+
+test_cmd "Verify --serve without a socket path results in an error-exit" \
+    2 "error: --serve requires --socket" \
+    env -u CIRRUS_CI_ENV_SOCKET $SUBJ_FILEPATH --serve $CIRRUS
+
+test_cmd "Verify a non-running daemon falls back to in-process rendering" \
+    0 "container quay.io/libpod/fedora_podman:c6524344056676352" \
+    $SUBJ_FILEPATH --socket /path/to/not/existing.sock --inst 'Ext. services' $CIRRUS
+
 exit_with_status